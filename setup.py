@@ -19,6 +19,8 @@ setup(
     packages=['story'],
     include_package_data=True,
     install_requires=['Pygments'],
+    # contextvars for the active translation, socket.send_fds for the daemon
+    python_requires='>=3.9',
     license='MIT license',
     zip_safe=False,
     keywords='story',
@@ -28,9 +30,10 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
     test_suite='tests',
     tests_require=[]
@@ -1,9 +1,13 @@
 import codecs
-import inspect
+import hashlib
+import importlib
+import importlib.util
 import os
+import sys
+import time
 
-from .format import highlight
-from .translation import gettext as _
+from .manifest import Manifest
+from .translation import gettext as _, override
 
 
 class AdventureVerificationError(Exception):
@@ -18,6 +22,17 @@ class BaseAdventure(object):
         '{name}.rst',
     ]
 
+    # 1-based position in the story, set by the AdventureManager.
+    position = None
+    # Tests run in a worker process with these limits, in seconds and
+    # bytes. Set `sandboxed` to False to run them in the current process.
+    sandboxed = True
+    time_limit = 10
+    cpu_time_limit = 10
+    memory_limit = 512 * 1024 * 1024
+    # Input given to the learner's program by `story run`.
+    run_input = ''
+
     def __init__(self, manager):
         self.manager = manager
 
@@ -31,32 +46,53 @@ class BaseAdventure(object):
 
     @property
     def completed(self):
-        return self.name in self.manager.completed
+        return self.name in self.manager.completed_set
+
+    def get_module_file(self):
+        # Like inspect.getfile(), without importing inspect and its
+        # dependencies for every command.
+        return sys.modules[self.__class__.__module__].__file__
 
     def get_path(self, file):
         return os.path.join(
-            os.path.dirname(inspect.getfile(self.__class__)),
+            os.path.dirname(self.get_module_file()),
             file)
 
-    @property
-    def problem(self):
+    def find_file(self, name, language):
+        """Return the path of the `name` document in `language`, or None."""
         for file in self.files:
-            file = self.get_path(
-                file.format(name='README', language=self.manager.language))
+            file = self.get_path(file.format(name=name, language=language))
             if os.path.exists(file):
-                with codecs.open(file, encoding='utf-8') as f:
-                    return f.read()
-        raise Exception('Adventure description not found')
+                return file
+        return None
+
+    def get_file(self, name):
+        """
+        Return the path of the `name` document in the learner's language,
+        from the manifest when it's up to date.
+        """
+        language = self.manager.language
+        manifest = getattr(self.manager, 'manifest', None)
+        metadata = manifest.get(self.name) if manifest is not None else None
+        if metadata is not None and language in metadata['files']:
+            return metadata['files'][language].get(name)
+        return self.find_file(name, language)
+
+    @property
+    def problem(self):
+        file = self.get_file('README')
+        if file is None:
+            raise Exception('Adventure description not found')
+        with codecs.open(file, encoding='utf-8') as f:
+            return f.read()
 
     @property
     def solution(self):
-        for file in self.files:
-            file = self.get_path(
-                file.format(name='SOLUTION', language=self.manager.language))
-            if os.path.exists(file):
-                with codecs.open(file, encoding='utf-8') as f:
-                    return f.read()
-        raise Exception('Solution file not found')
+        file = self.get_file('SOLUTION')
+        if file is None:
+            raise Exception('Solution file not found')
+        with codecs.open(file, encoding='utf-8') as f:
+            return f.read()
 
     def get_context(self):
         return {
@@ -65,59 +101,226 @@ class BaseAdventure(object):
             'story_title': self.manager.title,
             'story_adventures': len(self.manager.adventures),
             'adventure_title': self.title,
-            'adventure_position': self.manager.adventures.index(self) + 1,
+            'adventure_position': self.position,
         }
 
+    # Documents are rendered in the learner's language whatever translation
+    # is active, so a single process can serve many learners concurrently.
+
+    def get_problem_document(self):
+        with override(self.manager.language):
+            context = self.get_context()
+            context['adventure_problem'] = self.problem
+            return problem_wrapper.format(**context)
+
+    def get_solution_document(self):
+        with override(self.manager.language):
+            context = self.get_context()
+            context['adventure_solution'] = self.solution
+            return solution_wrapper.format(**context)
+
     @property
     def problem_formatted(self):
-        context = self.get_context()
-        context['adventure_problem'] = self.problem
-        return highlight(problem_wrapper.format(**context))
+        # pygments is slow to import, only load it when highlighting
+        from .format import highlight
+        return highlight(self.get_problem_document())
 
     @property
     def solution_formatted(self):
-        context = self.get_context()
-        context['adventure_solution'] = self.solution
-        return highlight(solution_wrapper.format(**context))
+        from .format import highlight
+        return highlight(self.get_solution_document())
+
+    def write_problem(self, outfile):
+        """Highlight the problem and write it as it's being rendered."""
+        from .format import highlight_to
+        highlight_to(self.get_problem_document(), outfile)
+
+    def write_solution(self, outfile):
+        from .format import highlight_to
+        highlight_to(self.get_solution_document(), outfile)
 
     @property
     def test_formatted(self):
-        if (self.completed):
-            return _('Good job! You\'ve completed the adventure')
-        else:
-            return _('It didn\'t work. Try again.')
-
-    def verify(self, file):
+        with override(self.manager.language):
+            if (self.completed):
+                return str(_('Good job! You\'ve completed the adventure'))
+            else:
+                return str(_('It didn\'t work. Try again.'))
+
+    def run(self, file, warm=True):
+        """Run the learner's program against `run_input`."""
+        # The runner loads multiprocessing and subprocess, only import it
+        # for the commands running programs.
+        from .runner import run_program
+        result = run_program(
+            file, self.run_input, sys.stdout,
+            time_limit=self.time_limit,
+            cpu_time_limit=self.cpu_time_limit,
+            memory_limit=self.memory_limit,
+            warm=warm)
+        if result.timed_out:
+            sys.stderr.write(str(_('Your program took too long.\n')))
+            return 1
+        return result.returncode
+
+    def run_test(self, file):
+        """Test `file`, returning a VerificationResult."""
+        from .runner import VerificationResult, run_in_process, run_test
+        if self.sandboxed:
+            return run_test(self, file)
+        start = time.monotonic()
+        status, message = run_in_process(self, file)
+        return VerificationResult(status, message, time.monotonic() - start)
+
+    def get_result_key(self, file):
+        """
+        Identify a verification by the story version, the adventure, its
+        test code and the submitted file. None if the file can't be read.
+        """
+        digest = hashlib.sha1()
+        digest.update('{}\x00{}\x00'.format(
+            self.manager.get_version(), self.name).encode('utf8'))
         try:
-            self.test(file)
+            with open(self.get_module_file(), 'rb') as f:
+                digest.update(f.read())
+            digest.update(b'\x00')
+            with open(file, 'rb') as f:
+                digest.update(f.read())
+        except (OSError, TypeError, AttributeError, KeyError):
+            return None
+        return digest.hexdigest()
+
+    def check(self, file, use_cache=True):
+        """
+        Test `file`, recording the adventure as completed if it passes, and
+        return the VerificationResult.
+        """
+        from .runner import VerificationResult
+        key = self.get_result_key(file) if use_cache else None
+        result = None
+        if key is not None:
+            result = self.manager.get_cached_result(key)
+        if result is None:
+            result = self.run_test(file)
+            # Timeouts and errors may not happen again, only cache verdicts.
+            if key is not None and result.status in (
+                    VerificationResult.PASSED, VerificationResult.FAILED):
+                self.manager.cache_result(key, result)
+        if result.passed:
             self.manager.completed = self.name
             self.manager.current = None
+        return result
+
+    def verify(self, file, use_cache=True):
+        result = self.check(file, use_cache)
+        if result.passed:
             print(self.test_formatted)
             return 0
-        except AdventureVerificationError as e:
-            print(str(e))
+        print(result.message)
+        return 1
 
     def test(self, file):
         pass
 
 
+class LazyAdventure(object):
+    """
+    Stand-in for an adventure declared by the dotted path of its module
+
+    The name, position and completion state are known without importing the
+    module, and so is the title when the story has an up to date manifest.
+    It's imported, and the adventure created, the first time any other
+    attribute is accessed.
+    """
+
+    def __init__(self, manager, path):
+        self.manager = manager
+        self.path = path
+        self.name = path.rsplit('.', 1)[-1]
+        self.position = None
+        self._adventure = None
+
+    def __repr__(self):
+        return '<LazyAdventure {}>'.format(self.path)
+
+    @property
+    def completed(self):
+        return self.name in self.manager.completed_set
+
+    @property
+    def title(self):
+        metadata = self.manager.manifest.get(self.name)
+        if metadata is not None:
+            title = metadata['titles'].get(self.manager.language)
+            if title is not None:
+                return title
+        return self.adventure.title
+
+    @property
+    def adventure(self):
+        if self._adventure is None:
+            module = importlib.import_module(self.path)
+            adventure = module.Adventure(self.manager)
+            adventure.position = self.position
+            self._adventure = adventure
+        return self._adventure
+
+    def __getattr__(self, name):
+        return getattr(self.adventure, name)
+
+
 class AdventureManager(object):
+    """
+    Adventures of a story
+
+    `adventures` lists the adventure modules, or their dotted paths (may be
+    relative to the story package) to import them only when needed.
+    `manifest_filename` defaults to manifest.json next to the story module.
+    """
 
     adventures = []
+    manifest_filename = None
+    _manifest = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         adventures = []
-        for adventure_module in self.adventures:
-            adventure = adventure_module.Adventure(self)
+        adventures_by_name = {}
+        for position, adventure_module in enumerate(self.adventures, 1):
+            if isinstance(adventure_module, str):
+                adventure = LazyAdventure(
+                    self, self.resolve_adventure_path(adventure_module))
+            else:
+                adventure = adventure_module.Adventure(self)
+            if adventure.name in adventures_by_name:
+                raise ValueError(
+                    'Duplicated adventure name: {}'.format(adventure.name))
+            adventure.position = position
             adventures.append(adventure)
+            adventures_by_name[adventure.name] = adventure
         self.adventures = adventures
+        self.adventures_by_name = adventures_by_name
+
+    def resolve_adventure_path(self, path):
+        package = sys.modules[self.__class__.__module__].__package__
+        return importlib.util.resolve_name(path, package)
 
     def get_adventure(self, name):
-        for adventure in self.adventures:
-            if adventure.name == name:
-                return adventure
-        return None
+        return self.adventures_by_name.get(name)
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = Manifest(self.get_manifest_filename())
+        return self._manifest
+
+    def get_manifest_filename(self):
+        if self.manifest_filename:
+            return self.manifest_filename
+        module = sys.modules[self.__class__.__module__]
+        return os.path.join(
+            os.path.dirname(os.path.abspath(module.__file__)),
+            'manifest.json')
 
 
 problem_wrapper = _('''
@@ -0,0 +1,306 @@
+"""
+Storage backends for the story progress
+"""
+import codecs
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class BaseBackend(object):
+    """
+    Progress storage
+
+    Values are stored per story and key. Changes may be kept in memory until
+    `flush()` is called. Lists stored under one of `merged_keys` are merged
+    with the stored value instead of replacing it, so concurrent commands
+    don't lose each other's progress.
+    """
+
+    merged_keys = ('completed',)
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def load(self):
+        """Return the progress of every story as a dict of dicts."""
+        raise NotImplementedError(
+            'Subclasses of BaseBackend must provide a load() method')
+
+    def save(self):
+        raise NotImplementedError(
+            'Subclasses of BaseBackend must provide a save() method')
+
+    def flush(self):
+        """Save pending changes, if any."""
+        self.save()
+
+    def close(self):
+        """Release the resources held, pending changes are discarded."""
+        pass
+
+    def get_story(self, story):
+        return self.load().get(story, {})
+
+    def set_story(self, story, values):
+        raise NotImplementedError(
+            'Subclasses of BaseBackend must provide a set_story() method')
+
+    def get(self, story, key, default=None):
+        return self.get_story(story).get(key, default)
+
+    def set(self, story, key, value):
+        raise NotImplementedError(
+            'Subclasses of BaseBackend must provide a set() method')
+
+    def merge_value(self, key, stored, value):
+        """Return the value to store for `key` given the stored one."""
+        if (key in self.merged_keys and
+                isinstance(stored, list) and isinstance(value, list)):
+            known = set(stored)
+            return stored + [item for item in value if item not in known]
+        return value
+
+
+class JSONBackend(BaseBackend):
+    """
+    Keep the progress of all the stories in a single JSON document.
+
+    Changes are recorded and, on save, merged into the document read again
+    from disk while holding an exclusive lock on `lock_filename`. The
+    document is then written back as a whole, atomically, and only if
+    something changed.
+    """
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self._data = None
+        self._changes = {}
+        self._replaced = set()
+
+    @property
+    def lock_filename(self):
+        return self.filename + '.lock'
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive advisory lock on the progress file."""
+        with open(self.lock_filename, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self):
+        if not os.path.exists(self.filename):
+            return {}
+        try:
+            with codecs.open(self.filename, encoding='utf8') as f:
+                return json.loads(f.read())
+        except:
+            # TODO: Add error handling
+            return {}
+
+    def load(self):
+        if self._data is None:
+            self._data = self.read()
+        return self._data
+
+    def merge(self, data):
+        """Apply the pending changes to `data`, a document read from disk."""
+        for story, values in self._changes.items():
+            if story in self._replaced:
+                data[story] = values
+                continue
+            stored = data.setdefault(story, {})
+            for key, value in values.items():
+                stored[key] = self.merge_value(key, stored.get(key), value)
+        return data
+
+    def save(self):
+        """
+        Write the whole document to `filename` atomically: the content goes
+        to a temporary file in the same directory which then replaces the
+        original.
+        """
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with self.lock():
+            data = self.merge(self.read())
+            fd, temp = tempfile.mkstemp(
+                dir=directory, prefix='.pyschool-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf8') as f:
+                    f.write(json.dumps(data))
+                os.replace(temp, self.filename)
+            except:
+                os.unlink(temp)
+                raise
+        self._data = data
+        self._changes = {}
+        self._replaced = set()
+
+    def flush(self):
+        if self._changes:
+            self.save()
+
+    def get_story(self, story):
+        data = self.load()
+        if story not in data:
+            data[story] = {}
+        return data[story]
+
+    def set_story(self, story, values):
+        data = self.load()
+        if data.get(story) != values:
+            data[story] = values
+            self._changes[story] = dict(values)
+            self._replaced.add(story)
+
+    def set(self, story, key, value):
+        values = self.get_story(story)
+        if key not in values or values[key] != value:
+            values[key] = value
+            self._changes.setdefault(story, {})[key] = value
+
+
+class SQLiteBackend(BaseBackend):
+    """
+    Keep the progress in a SQLite database, one row per story and key.
+
+    Reads only touch the rows involved. Changes are kept in memory and, on
+    `flush()`, merged into the stored rows inside a short immediate
+    transaction, so the database write lock is only held while saving.
+    """
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self._connection = None
+        self._changes = {}
+        self._replaced = set()
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            # Only stories storing their progress in SQLite load it.
+            import sqlite3
+            connection = sqlite3.connect(self.filename)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS progress ('
+                'story TEXT NOT NULL, '
+                'key TEXT NOT NULL, '
+                'value TEXT NOT NULL, '
+                'PRIMARY KEY (story, key))')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def load(self):
+        data = {}
+        rows = self.connection.execute(
+            'SELECT story, key, value FROM progress')
+        for story, key, value in rows:
+            data.setdefault(story, {})[key] = json.loads(value)
+        for story in self._changes:
+            data[story] = self.get_story(story)
+        return data
+
+    def read_story(self, story):
+        rows = self.connection.execute(
+            'SELECT key, value FROM progress WHERE story = ?', (story,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def read(self, story, key, default=None):
+        row = self.connection.execute(
+            'SELECT value FROM progress WHERE story = ? AND key = ?',
+            (story, key)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def save(self):
+        """Merge the pending changes into the database and commit them."""
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for story, values in self._changes.items():
+                if story in self._replaced:
+                    connection.execute(
+                        'DELETE FROM progress WHERE story = ?', (story,))
+                    rows = values.items()
+                else:
+                    rows = []
+                    missing = object()
+                    for key, value in values.items():
+                        stored = self.read(story, key, missing)
+                        value = self.merge_value(key, stored, value)
+                        if stored != value:
+                            rows.append((key, value))
+                connection.executemany(
+                    'INSERT OR REPLACE INTO progress (story, key, value) '
+                    'VALUES (?, ?, ?)',
+                    [(story, key, json.dumps(value)) for key, value in rows])
+        except:
+            connection.rollback()
+            raise
+        connection.commit()
+        self._changes = {}
+        self._replaced = set()
+
+    def flush(self):
+        if self._changes:
+            self.save()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._changes = {}
+        self._replaced = set()
+
+    def get_story(self, story):
+        if story in self._replaced:
+            return dict(self._changes[story])
+        values = self.read_story(story)
+        values.update(self._changes.get(story, {}))
+        return values
+
+    def set_story(self, story, values):
+        if self.get_story(story) == values:
+            return
+        self._changes[story] = dict(values)
+        self._replaced.add(story)
+
+    def get(self, story, key, default=None):
+        changes = self._changes.get(story, {})
+        if key in changes:
+            return changes[key]
+        if story in self._replaced:
+            return default
+        return self.read(story, key, default)
+
+    def set(self, story, key, value):
+        missing = object()
+        stored = self.get(story, key, missing)
+        value = self.merge_value(key, stored, value)
+        if stored == value:
+            return
+        self._changes.setdefault(story, {})[key] = value
+
+
+def migrate(source, target):
+    """Copy the progress of every story from one backend into another."""
+    for story, values in source.load().items():
+        target.set_story(story, values)
+    target.flush()
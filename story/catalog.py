@@ -0,0 +1,364 @@
+"""
+Compiled translation catalogs
+
+The catalogs of every locale directory are merged and compiled into a single
+GNU .mo file per language, with its hash table, which is then memory mapped.
+Lookups read the mapped file directly, so processes using the same catalog
+share its pages instead of each building a dict.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = 0x950412de
+# Bump when the compiled format changes to ignore previously compiled files.
+VERSION = 1
+
+
+def get_catalog_dir():
+    # Read on every call, the daemon runs commands with their own environment.
+    return os.environ.get(
+        'STORY_CATALOG_DIR', os.path.expanduser('~/.cache/pyschool'))
+
+
+# Parsed sources by (path, mtime, size), so compiling a catalog for a new set
+# of locale directories only parses the new sources.
+_sources = {}
+
+
+def hashpjw(data):
+    """Hash function used by GNU gettext for the .mo hash table."""
+    value = 0
+    for char in data:
+        if char == 0:
+            break
+        value = ((value << 4) + char) & 0xffffffff
+        high = value & 0xf0000000
+        if high:
+            value ^= high >> 24
+            value ^= high
+    return value
+
+
+def next_prime(number):
+    def is_prime(candidate):
+        if candidate < 2:
+            return False
+        divisor = 2
+        while divisor * divisor <= candidate:
+            if candidate % divisor == 0:
+                return False
+            divisor += 1
+        return True
+
+    while not is_prime(number):
+        number += 1
+    return number
+
+
+def parse_po(filename):
+    """
+    Read the translated messages of a .po file as a dict of bytes, keyed the
+    way they're stored in .mo files: "context\\x04msgid" for messages with
+    context and "msgid\\x00msgid_plural" for plurals. Fuzzy messages are left
+    out like msgfmt does, except for the header.
+    """
+    # Only needed when compiling, which most commands don't do.
+    import ast
+
+    messages = {}
+    entry = {}
+    field = None
+
+    def add_entry():
+        if 'msgid' not in entry:
+            return
+        if entry.get('fuzzy') and entry['msgid']:
+            return
+        key = entry['msgid']
+        if 'msgid_plural' in entry:
+            key += '\x00' + entry['msgid_plural']
+            forms = sorted(
+                (int(name[7:-1]), value) for name, value in entry.items()
+                if name.startswith('msgstr['))
+            value = '\x00'.join(form for index, form in forms)
+        else:
+            value = entry.get('msgstr', '')
+        if 'msgctxt' in entry:
+            key = entry['msgctxt'] + '\x04' + key
+        if value.strip('\x00'):
+            messages[key.encode('utf8')] = value.encode('utf8')
+
+    with open(filename, encoding='utf8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#'):
+                # Comments and flags come before the entry they belong to.
+                if 'msgid' in entry:
+                    add_entry()
+                    entry = {}
+                if line.startswith('#,') and 'fuzzy' in [
+                        flag.strip() for flag in line[2:].split(',')]:
+                    entry['fuzzy'] = True
+                continue
+            if line.startswith('"'):
+                entry[field] += ast.literal_eval(line)
+                continue
+            field, string = line.split(None, 1)
+            if field in ('msgctxt', 'msgid') and 'msgid' in entry:
+                add_entry()
+                entry = {}
+            entry[field] = ast.literal_eval(string)
+    add_entry()
+    return messages
+
+
+def read_mo(filename):
+    """Read the messages of a .mo file as a dict of bytes."""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    magic = struct.unpack('<I', data[:4])[0]
+    order = '<' if magic == MAGIC else '>'
+    count, originals, translations = struct.unpack(
+        order + '3I', data[8:20])
+    messages = {}
+    for index in range(count):
+        length, offset = struct.unpack_from(
+            order + '2I', data, originals + index * 8)
+        key = data[offset:offset + length]
+        length, offset = struct.unpack_from(
+            order + '2I', data, translations + index * 8)
+        messages[key] = data[offset:offset + length]
+    return messages
+
+
+def write_mo(messages, filename):
+    """Write a dict of bytes as a .mo file with a hash table."""
+    keys = sorted(messages)
+    count = len(keys)
+    hash_size = next_prime(max(3, count * 4 // 3 + 1))
+    originals = 28
+    translations = originals + count * 8
+    hash_offset = translations + count * 8
+    offset = hash_offset + hash_size * 4
+
+    table = [0] * hash_size
+    original_index = []
+    translation_index = []
+    strings = []
+    for index, key in enumerate(keys):
+        value = messages[key]
+        original_index.append((len(key), offset))
+        strings.append(key + b'\x00')
+        offset += len(key) + 1
+        translation_index.append((len(value), offset))
+        strings.append(value + b'\x00')
+        offset += len(value) + 1
+
+        hash_value = hashpjw(key)
+        position = hash_value % hash_size
+        increment = 1 + hash_value % (hash_size - 2)
+        while table[position]:
+            if position >= hash_size - increment:
+                position -= hash_size - increment
+            else:
+                position += increment
+        table[position] = index + 1
+
+    content = b''.join([
+        struct.pack('<7I', MAGIC, 0, count, originals, translations,
+                    hash_size, hash_offset),
+        b''.join(struct.pack('<2I', *item) for item in original_index),
+        b''.join(struct.pack('<2I', *item) for item in translation_index),
+        struct.pack('<{}I'.format(hash_size), *table),
+    ] + strings)
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            # mkstemp creates the file readable only by its owner, compiled
+            # catalogs are shared by every user of the story.
+            os.fchmod(f.fileno(), 0o644)
+        os.replace(temp, filename)
+    except:
+        os.unlink(temp)
+        raise
+
+
+def get_sources(domain, language, localedirs):
+    """Return the catalog sources of `language`, .po files preferred."""
+    sources = []
+    for localedir in localedirs:
+        base = os.path.join(
+            localedir, 'locale', language, 'LC_MESSAGES', domain)
+        for extension in ('.po', '.mo'):
+            if os.path.exists(base + extension):
+                sources.append(base + extension)
+                break
+    return sources
+
+
+def read_source(key):
+    if key not in _sources:
+        source = key[0]
+        if source.endswith('.po'):
+            _sources[key] = parse_po(source)
+        else:
+            _sources[key] = read_mo(source)
+    return _sources[key]
+
+
+def is_legacy(name, prefix):
+    """
+    Whether `name` is a catalog of the same domain and language compiled
+    before file names started with the digest of the source paths, named
+    "domain-language-<sha1>.mo".
+    """
+    legacy = prefix.rsplit('-', 2)[0] + '-'
+    digest = name[len(legacy):-len('.mo')]
+    return (name.startswith(legacy) and name.endswith('.mo') and
+            len(digest) == 40 and
+            all(char in '0123456789abcdef' for char in digest))
+
+
+def prune(directory, prefix, filename):
+    """
+    Remove the catalogs compiled before `filename` from the same sources,
+    and those left by the previous naming. Processes still mapping them
+    keep reading them until they unmap them.
+    """
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if path == filename:
+            continue
+        if ((name.startswith(prefix) and name.endswith('.mo')) or
+                is_legacy(name, prefix)):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def compile_catalog(domain, language, localedirs, directory=None):
+    """
+    Return the compiled catalog merging the sources found in `localedirs`
+    for `language`, compiling it into `directory` if needed. Later locale
+    directories override messages of the previous ones. Returns None if
+    there are no sources.
+
+    The catalogs previously compiled from the same source paths are removed,
+    so editing the sources doesn't pile up files.
+    """
+    sources = get_sources(domain, language, localedirs)
+    if not sources:
+        return None
+    # Identifies the source paths, and the digest their contents too.
+    prefix = '{}-{}-{}-'.format(domain, language, hashlib.sha1(
+        '\x00'.join(sources).encode('utf8')).hexdigest()[:12])
+    digest = hashlib.sha1(str(VERSION).encode())
+    keys = []
+    for source in sources:
+        stat = os.stat(source)
+        keys.append((source, stat.st_mtime_ns, stat.st_size))
+        digest.update('{}\x00{}\x00{}\x00'.format(*keys[-1]).encode('utf8'))
+    directory = directory or get_catalog_dir()
+    filename = os.path.join(directory, prefix + digest.hexdigest() + '.mo')
+    if not os.path.exists(filename):
+        messages = {}
+        for key in keys:
+            catalog = read_source(key)
+            # Keep the header of the first catalog, like the merge of
+            # GNUTranslations does.
+            if b'' in messages:
+                catalog = dict(catalog)
+                catalog.pop(b'', None)
+            messages.update(catalog)
+        os.makedirs(directory, exist_ok=True)
+        write_mo(messages, filename)
+        prune(directory, prefix, filename)
+    return filename
+
+
+class MappedCatalog(object):
+    """
+    Read-only mapping over a memory mapped .mo file
+
+    Supports the keys used by GNUTranslations: the message, or a tuple of
+    the message and the plural form index.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = struct.unpack_from('<I', self.data)[0]
+        self.order = '<' if magic == MAGIC else '>'
+        (self.count, self.originals, self.translations, self.hash_size,
+         self.hash_offset) = struct.unpack_from(
+            self.order + '5I', self.data, 8)
+
+    def __repr__(self):
+        return '<MappedCatalog {}>'.format(self.filename)
+
+    def __len__(self):
+        return self.count
+
+    def find(self, message, plural):
+        """Return the raw translation of `message`, or None."""
+        key = message.encode('utf8')
+        hash_value = hashpjw(key)
+        position = hash_value % self.hash_size
+        increment = 1 + hash_value % (self.hash_size - 2)
+        while True:
+            index = struct.unpack_from(
+                self.order + 'I', self.data,
+                self.hash_offset + position * 4)[0]
+            if not index:
+                return None
+            length, offset = struct.unpack_from(
+                self.order + '2I', self.data,
+                self.originals + (index - 1) * 8)
+            original = self.data[offset:offset + length]
+            if plural:
+                matches = original.startswith(key + b'\x00')
+            else:
+                matches = original == key
+            if matches:
+                length, offset = struct.unpack_from(
+                    self.order + '2I', self.data,
+                    self.translations + (index - 1) * 8)
+                return self.data[offset:offset + length]
+            if position >= self.hash_size - increment:
+                position -= self.hash_size - increment
+            else:
+                position += increment
+
+    def get(self, key, default=None):
+        if isinstance(key, tuple):
+            message, form = key
+            translation = self.find(message, True)
+            if translation is None:
+                return default
+            forms = translation.split(b'\x00')
+            if form >= len(forms):
+                return default
+            return forms[form].decode('utf8')
+        translation = self.find(key, False)
+        if translation is None:
+            return default
+        return translation.decode('utf8')
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
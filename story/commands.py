@@ -1,12 +1,46 @@
 import argparse
+import json
+import os
 import sys
+import time
 
 from . import __version__
-from .menu import Menu
 from .translation import gettext as _
 
 
+class CommandError(Exception):
+    """Raised by commands to stop with an error `message` and exit `code`."""
+
+    def __init__(self, message, code=1):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+    def __str__(self):
+        return str(self.message).strip()
+
+
+class CommandResult(object):
+    """
+    What a command returns: `data` made of JSON types, written by
+    `--format json`, and the exit `code`.
+    """
+
+    def __init__(self, data=None, code=0):
+        self.data = data
+        self.code = code
+
+    def __repr__(self):
+        return '<CommandResult {}>'.format(self.code)
+
+
 class BaseCommand(object):
+    """
+    A subcommand of the story
+
+    `handle()` returns a CommandResult, or None, and raises CommandError
+    instead of exiting. `write_result()` writes the result as text.
+    """
 
     name = None
     help = None
@@ -21,6 +55,18 @@ class BaseCommand(object):
         raise NotImplementedError(
             'Subclasses of BaseCommand must provide a handle() method')
 
+    def write_result(self, result, outfile):
+        pass
+
+    def get_current_adventure(self):
+        current = self.manager.current
+        if current is None:
+            raise CommandError(_('Please select an adventure first.\n'))
+        adventure = self.manager.get_adventure(current)
+        if not adventure:
+            raise CommandError(_('Invalid adventure: {}.\n').format(current))
+        return adventure
+
 
 class MenuCommand(BaseCommand):
 
@@ -28,6 +74,8 @@ class MenuCommand(BaseCommand):
     help = _('Show a menu to interactively select an adventure.')
 
     def handle(self, args):
+        # curses is only needed by the menu, don't load it for other commands
+        from .menu import Menu
         Menu(self.manager).show()
 
 
@@ -37,12 +85,21 @@ class ListCommand(BaseCommand):
     help = _('Show a newline-separated list of all the adventures.')
 
     def handle(self, args):
-        for adventure in self.manager.adventures:
-            sys.stdout.write('[{}] {}\n'.format(
-                '*' if adventure.completed else ' ',
-                adventure.name
+        return CommandResult([
+            {
+                'name': adventure.name,
+                'position': adventure.position,
+                'completed': adventure.completed,
+            }
+            for adventure in self.manager.adventures
+        ])
+
+    def write_result(self, result, outfile):
+        for adventure in result.data:
+            outfile.write('[{}] {}\n'.format(
+                '*' if adventure['completed'] else ' ',
+                adventure['name']
             ))
-        sys.exit(0)
 
 
 class SelectCommand(BaseCommand):
@@ -56,6 +113,7 @@ class SelectCommand(BaseCommand):
 
     def handle(self, args):
         self.manager.current = args.name
+        return CommandResult({'current': args.name})
 
 
 class CurrentCommand(BaseCommand):
@@ -64,16 +122,15 @@ class CurrentCommand(BaseCommand):
     help = _('Show the currently selected adventure.')
 
     def handle(self, args):
-        current = self.manager.current
-        if current is None:
-            sys.stderr.write(_('Please select an adventure first.\n'))
-            sys.exit(1)
-        adventure = self.manager.get_adventure(current)
-        if not adventure:
-            sys.stderr.write(_('Invalid adventure: {}.\n').format(current))
-            sys.exit(1)
-        sys.stdout.write('{}\n'.format(adventure.name))
-        sys.exit(0)
+        adventure = self.get_current_adventure()
+        return CommandResult({
+            'name': adventure.name,
+            'position': adventure.position,
+            'completed': adventure.completed,
+        })
+
+    def write_result(self, result, outfile):
+        outfile.write('{}\n'.format(result.data['name']))
 
 
 class PrintCommand(BaseCommand):
@@ -82,15 +139,16 @@ class PrintCommand(BaseCommand):
     help = _('Print the adventure.')
 
     def handle(self, args):
-        current = self.manager.current
-        if current is None:
-            sys.stderr.write(_('Please select an adventure first.\n'))
-            sys.exit(1)
-        adventure = self.manager.get_adventure(current)
-        if not adventure:
-            sys.stderr.write(_('Invalid adventure: {}.\n').format(current))
-            sys.exit(1)
-        sys.stdout.write(adventure.problem_formatted)
+        adventure = self.get_current_adventure()
+        return CommandResult({
+            'name': adventure.name,
+            'document': adventure.get_problem_document(),
+        })
+
+    def write_result(self, result, outfile):
+        # pygments is slow to import, only load it when highlighting
+        from .format import highlight_to
+        highlight_to(result.data['document'], outfile)
 
 
 class NextCommand(BaseCommand):
@@ -100,7 +158,7 @@ class NextCommand(BaseCommand):
              'after the currently selected adventure.')
 
     def handle(self, args):
-        sys.stdout.write(_('Not implemented.\n'))
+        raise CommandError(_('Not implemented.\n'))
 
 
 class ResetCommand(BaseCommand):
@@ -110,6 +168,8 @@ class ResetCommand(BaseCommand):
 
     def handle(self, args):
         self.manager.data = {}
+        # The progress left, written by --format json only.
+        return CommandResult(self.manager.data)
 
 
 class RunCommand(BaseCommand):
@@ -117,8 +177,18 @@ class RunCommand(BaseCommand):
     name = 'run'
     help = _('Run your program against the selected input.')
 
+    def create_parser(self, parser):
+        super().create_parser(parser)
+        parser.add_argument('file')
+        parser.add_argument(
+            '--cold', action='store_true',
+            help=_('Start a new interpreter instead of forking this one.'))
+
     def handle(self, args):
-        sys.stdout.write(_('Not implemented.\n'))
+        adventure = self.get_current_adventure()
+        # The program's output is streamed as it runs.
+        code = adventure.run(args.file, warm=not args.cold)
+        return CommandResult({'code': code}, code)
 
 
 class VerifyCommand(BaseCommand):
@@ -129,17 +199,172 @@ class VerifyCommand(BaseCommand):
     def create_parser(self, parser):
         super().create_parser(parser)
         parser.add_argument('file')
+        parser.add_argument(
+            '--no-cache', action='store_false', dest='use_cache',
+            help=_('Verify again even if the same file was verified.'))
+        parser.add_argument(
+            '-w', '--watch', action='store_true',
+            help=_('Keep running and verify every time the file changes.'))
 
     def handle(self, args):
-        current = self.manager.current
-        if current is None:
-            sys.stderr.write(_('Please select an adventure first.\n'))
-            sys.exit(1)
-        adventure = self.manager.get_adventure(current)
-        if not adventure:
-            sys.stderr.write(_('Invalid adventure: {}.\n').format(current))
-            sys.exit(1)
-        sys.exit(adventure.verify(args.file))
+        adventure = self.get_current_adventure()
+        if args.watch:
+            return self.watch(adventure, args)
+        result = adventure.check(args.file, use_cache=args.use_cache)
+        data = {'name': adventure.name, 'file': args.file}
+        data.update(result.as_dict())
+        return CommandResult(data, 0 if result.passed else 1)
+
+    def write_result(self, result, outfile):
+        if result.data.get('watched'):
+            # Every verification was written as it happened.
+            return
+        if result.code == 0:
+            adventure = self.manager.get_adventure(result.data['name'])
+            outfile.write('{}\n'.format(adventure.test_formatted))
+        else:
+            outfile.write('{}\n'.format(result.data['message']))
+
+    def watch(self, adventure, args):
+        # The adventure, the translations and the highlighter stay loaded
+        # between verifications.
+        from .watch import watch
+
+        def verify():
+            adventure.verify(args.file, use_cache=args.use_cache)
+            self.manager.flush()
+
+        try:
+            watch(args.file, verify)
+        except KeyboardInterrupt:
+            pass
+        return CommandResult(
+            {'name': adventure.name, 'file': args.file, 'watched': True})
+
+
+class VerifyBatchCommand(BaseCommand):
+
+    name = 'verify-batch'
+    help = _('Verify many submissions in parallel, printing JSON lines.')
+
+    def create_parser(self, parser):
+        super().create_parser(parser)
+        parser.add_argument(
+            'source',
+            help=_('A directory with a subdirectory of submissions per '
+                   'adventure, or a file with a JSON object per line with '
+                   'the "adventure" and "file" to verify.'))
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=None,
+            help=_('Number of submissions verified at a time.'))
+
+    def get_submissions(self, source):
+        if os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                directory = os.path.join(source, name)
+                if not os.path.isdir(directory):
+                    continue
+                for file in sorted(os.listdir(directory)):
+                    yield name, os.path.join(directory, file)
+        else:
+            base = os.path.dirname(os.path.abspath(source))
+            with open(source, encoding='utf8') as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        yield (item['adventure'],
+                               os.path.join(base, item['file']))
+
+    def write(self, adventure, file, result):
+        line = {'adventure': adventure, 'file': file}
+        line.update(result)
+        sys.stdout.write(json.dumps(line) + '\n')
+        sys.stdout.flush()
+
+    def handle(self, args):
+        # Workers are forked from this process, so they don't pay for the
+        # interpreter startup, the story import or the translations.
+        from .runner import VerificationResult, run_tests
+
+        start = time.monotonic()
+        jobs = []
+        count = passed = 0
+        for name, file in self.get_submissions(args.source):
+            adventure = self.manager.get_adventure(name)
+            if adventure is None:
+                count += 1
+                self.write(name, file, VerificationResult(
+                    VerificationResult.ERROR,
+                    str(_('Invalid adventure: {}.').format(name))).as_dict())
+            else:
+                jobs.append((adventure, file))
+        for (adventure, file), result in run_tests(jobs, args.jobs):
+            count += 1
+            passed += result.passed
+            self.write(adventure.name, file, result.as_dict())
+        elapsed = time.monotonic() - start
+        sys.stderr.write(
+            _('{count} submissions verified in {elapsed:.2f}s '
+              '({rate:.1f}/s), {passed} passed.\n').format(
+                count=count, elapsed=elapsed, passed=passed,
+                rate=count / elapsed if elapsed else 0))
+
+
+class StatsCommand(BaseCommand):
+
+    name = 'stats'
+    help = _('Show completion statistics over many progress files.')
+
+    def create_parser(self, parser):
+        super().create_parser(parser)
+        parser.add_argument(
+            'directory',
+            help=_('A directory with the progress files of the learners.'))
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=None,
+            help=_('Number of files read at a time.'))
+        parser.add_argument(
+            '--no-cache', action='store_false', dest='use_cache',
+            help=_('Read every file, even those not changed since the '
+                   'previous run.'))
+
+    def handle(self, args):
+        from .stats import collect, get_cache_filename
+
+        cache_filename = None
+        if args.use_cache:
+            cache_filename = get_cache_filename(
+                args.directory, self.manager.name)
+        stats = collect(
+            args.directory, self.manager.name,
+            [adventure.name for adventure in self.manager.adventures],
+            cache_filename, args.jobs)
+        return CommandResult(stats.as_dict())
+
+    def write_result(self, result, outfile):
+        data = result.data
+        learners = data['learners']
+
+        def percentage(count):
+            return 100 * count / learners if learners else 0
+
+        outfile.write(_('Learners: {}\n').format(learners))
+        outfile.write(str(_('\nCompleted by adventure:\n')))
+        for adventure in data['adventures']:
+            outfile.write('  {:3}. {:30} {:6} {:5.1f}%\n'.format(
+                adventure['position'], adventure['name'],
+                adventure['completed'], percentage(adventure['completed'])))
+        outfile.write(str(_('\nBy language:\n')))
+        for code, language in data['languages'].items():
+            outfile.write(_('  {}: {} learners, {} completions\n').format(
+                code, language['learners'],
+                sum(language['completed'].values())))
+        outfile.write(str(_('\nFunnel (reached, dropped off before):\n')))
+        for position, step in enumerate(data['funnel'], 1):
+            outfile.write('  {:3}. {:30} {:6} {:6}\n'.format(
+                position, step['name'], step['reached'], step['dropped']))
+        outfile.write(_('\n{read} files read, {cached} from the cache.\n')
+                      .format(**data['files']))
 
 
 class SolutionCommand(BaseCommand):
@@ -148,15 +373,30 @@ class SolutionCommand(BaseCommand):
     help = _('Print the solution for an adventure.')
 
     def handle(self, args):
-        current = self.manager.current
-        if current is None:
-            sys.stderr.write(_('Please select an adventure first.\n'))
-            sys.exit(1)
-        adventure = self.manager.get_adventure(current)
-        if not adventure:
-            sys.stderr.write(_('Invalid adventure: {}.\n').format(current))
-            sys.exit(1)
-        sys.stdout.write(adventure.solution_formatted)
+        adventure = self.get_current_adventure()
+        return CommandResult({
+            'name': adventure.name,
+            'document': adventure.get_solution_document(),
+        })
+
+    def write_result(self, result, outfile):
+        from .format import highlight_to
+        highlight_to(result.data['document'], outfile)
+
+
+class BuildManifestCommand(BaseCommand):
+
+    name = 'build-manifest'
+    help = _('Build the manifest used to list the adventures quickly.')
+
+    def handle(self, args):
+        manifest = self.manager.manifest
+        manifest.save(manifest.build(self.manager))
+        return CommandResult({'filename': manifest.filename})
+
+    def write_result(self, result, outfile):
+        outfile.write(
+            _('Manifest written to {}.\n').format(result.data['filename']))
 
 
 class HelpCommand(BaseCommand):
@@ -164,7 +404,7 @@ class HelpCommand(BaseCommand):
     name = 'help'
 
     def handle(self, *args):
-        self.manager.parser.print_help()
+        self.manager.create_parser().print_help()
 
 
 class CommandManager(object):
@@ -182,7 +422,10 @@ class CommandManager(object):
         ResetCommand,
         RunCommand,
         VerifyCommand,
+        VerifyBatchCommand,
+        StatsCommand,
         SolutionCommand,
+        BuildManifestCommand,
         HelpCommand,
     )
     default_command = MenuCommand.name
@@ -199,39 +442,107 @@ class CommandManager(object):
                 default_command = command
             commands.append(command)
         self.commands = commands
+        self.commands_by_name = {
+            command.name: command for command in commands}
         self.default_command = default_command
 
-    def create_parser(self):
-        if self.parser is None:
-            parser = argparse.ArgumentParser(
-                description=self.description,
-                add_help=True)
-            parser.add_argument(
-                '-v', '--version', action='version',
-                version=self.get_version())
-            parser.add_argument(
-                '-l', '--language', action='store',
-                help=_('Change the system to the specified language.'))
-            subparsers = parser.add_subparsers()
-            for command in self.commands:
-                subparser = subparsers.add_parser(
-                    command.name, help=command.help)
-                subparser.set_defaults(handle=command.handle)
-                command.create_parser(subparser)
+    def create_parser(self, commands=None):
+        """
+        Return a parser with the subparsers of `commands`, or of all the
+        commands by default. The parser of all the commands is kept in
+        `parser`.
+        """
+        if commands is None and self.parser is not None:
+            return self.parser
+        parser = argparse.ArgumentParser(
+            description=self.description,
+            add_help=True)
+        parser.add_argument(
+            '-v', '--version', action='version',
+            version=self.get_version())
+        parser.add_argument(
+            '-l', '--language', action='store',
+            help=_('Change the system to the specified language.'))
+        parser.add_argument(
+            '--format', choices=('text', 'json'), default='text',
+            help=_('Write the result as text or as JSON.'))
+        subparsers = parser.add_subparsers()
+        for command in self.commands if commands is None else commands:
+            subparser = subparsers.add_parser(
+                command.name, help=command.help)
+            subparser.set_defaults(command=command)
+            command.create_parser(subparser)
+        if commands is None:
             self.parser = parser
-        return self.parser
+        return parser
+
+    def get_called_commands(self, argv):
+        """
+        Return the commands whose parser is needed to parse `argv`, found
+        without parsing it: none when no command is given, the command
+        given, or None for all of them (for help, unknown commands and
+        options only the full parser knows).
+        """
+        arguments = iter(argv)
+        for argument in arguments:
+            if argument in ('-l', '--language', '--format'):
+                next(arguments, None)
+            elif argument.startswith(('--language=', '-l', '--format=')):
+                continue
+            elif argument.startswith('-'):
+                return None
+            else:
+                command = self.commands_by_name.get(argument)
+                return None if command is None else [command]
+        return []
 
     def get_version(self):
         return self.version
 
     def execute(self):
-        r = self.create_parser().parse_args(self.argv[1:])
-        if r.language:
-            self.language = r.language
-        if not hasattr(r, 'handle'):
-            self.default_command.handle(r)
+        argv = self.argv[1:]
+        # Only the parser of the command called is built.
+        parser = self.create_parser(self.get_called_commands(argv))
+        r = parser.parse_args(argv)
+        command = getattr(r, 'command', self.default_command)
+        # Progress changes made by the command are saved once, on exit.
+        with self:
+            if r.language:
+                self.language = r.language
+            try:
+                result = command.handle(r) or CommandResult()
+            except CommandError as e:
+                self.write_error(e, r.format)
+                result = CommandResult(code=e.code)
+            else:
+                self.write_result(command, result, r.format)
+        sys.exit(result.code)
+
+    def write_result(self, command, result, format):
+        if format == 'json':
+            if result.data is not None:
+                sys.stdout.write(json.dumps(result.data) + '\n')
+        else:
+            command.write_result(result, sys.stdout)
+
+    def write_error(self, error, format):
+        if format == 'json':
+            sys.stdout.write(json.dumps({'error': str(error)}) + '\n')
         else:
-            r.handle(r)
+            sys.stderr.write(str(error.message))
+
+    def call(self, name, *arguments):
+        """
+        Run the command `name` with `arguments`, given as on the command
+        line, and return its CommandResult. Errors raise CommandError.
+
+        Progress changes are saved when leaving the manager used as a
+        context manager, or on `flush()`.
+        """
+        command = self.commands_by_name[name]
+        parser = self.create_parser([command])
+        args = parser.parse_args([name] + list(arguments))
+        return command.handle(args) or CommandResult()
 
     @classmethod
     def begin(cls):
@@ -0,0 +1,303 @@
+"""
+Resident server keeping a story loaded, and the thin client talking to it
+
+The server imports the story, its adventures, the translations and the
+highlighter once, then forks a process per command. The client connects to
+the server's Unix socket, passes its standard streams, arguments,
+environment and working directory, and waits for the exit code. When no
+server is running, the client runs the command itself.
+
+Run the server with ``python -m story.daemon package.module:Story``, and
+call `client('package.module:Story')` from the story script. The server
+reloads the story whenever a file of the story package changes.
+"""
+import importlib
+import importlib.util
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+
+DAEMON_DIR = os.environ.get(
+    'STORY_DAEMON_DIR', os.path.expanduser('~/.cache/pyschool'))
+
+
+def get_address(story):
+    """Return the socket path of the server of `story`."""
+    return os.path.join(DAEMON_DIR, '{}.sock'.format(story.replace(':', '-')))
+
+
+def load_story(story):
+    """Import the story class from its "package.module:Class" path."""
+    module, name = story.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def client(story, argv=None, address=None):
+    """Run the command in `argv` through the server, or here if not running."""
+    argv = argv or sys.argv[:]
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(address or get_address(story))
+    except OSError:
+        connection.close()
+        load_story(story)(argv).execute()
+        sys.exit(0)
+    with connection:
+        sys.exit(request(connection, argv))
+
+
+def request(connection, argv):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    socket.send_fds(connection, [b'\x00'], [0, 1, 2])
+    connection.sendall(json.dumps({
+        'argv': argv,
+        'env': dict(os.environ),
+        'cwd': os.getcwd(),
+    }).encode('utf8') + b'\n')
+    reader = connection.makefile('rb')
+    pid = None
+    while True:
+        try:
+            line = reader.readline()
+        except KeyboardInterrupt:
+            # The command runs in the server's process group, forward ^C.
+            if pid is not None:
+                os.kill(pid, signal.SIGINT)
+            continue
+        if not line:
+            # The server went away without an exit code.
+            return 1
+        if pid is None:
+            pid = int(line)
+        else:
+            return int(line)
+
+
+def get_roots(story):
+    """Return the directories of the story package and of this library."""
+    spec = importlib.util.find_spec(story.split(':')[0].split('.')[0])
+    # The package directory, or the file of a top level module.
+    roots = list(spec.submodule_search_locations or [spec.origin])
+    roots.append(os.path.dirname(os.path.abspath(__file__)))
+    return roots
+
+
+def get_snapshot(roots):
+    """Return the modification time and size of every file under `roots`."""
+    snapshot = {}
+    for root in roots:
+        if os.path.isfile(root):
+            stat = os.stat(root)
+            snapshot[root] = (stat.st_mtime_ns, stat.st_size)
+        for directory, directories, files in os.walk(root):
+            directories[:] = [
+                name for name in directories
+                if name != '__pycache__' and not name.startswith('.')]
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def warm_up(story):
+    """Load what the commands use, so the forked processes start with it."""
+    from . import format, menu, runner  # noqa: F401
+    from .adventures import LazyAdventure
+    from .translation import get_translation
+    # The formatter is chosen per command, from its output and terminal.
+    for formatter_class in format.FORMATTERS:
+        format.get_formatter(formatter_class)
+    format.get_lexer()
+    get_translation()
+    for adventure in story.adventures:
+        if isinstance(adventure, LazyAdventure):
+            adventure.adventure
+    # Every command reads the progress again, and must not share the
+    # database connection of this process.
+    story.reload()
+
+
+def open_streams(fds):
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    sys.stdin = open(0, encoding='utf8', closefd=False)
+    # Line buffered like the interpreter does for terminals.
+    sys.stdout = open(
+        1, 'w', 1 if os.isatty(1) else -1, encoding='utf8', closefd=False)
+    sys.stderr = open(2, 'w', 1, encoding='utf8', closefd=False)
+
+
+def get_exit_code(error):
+    if error.code is None or isinstance(error.code, int):
+        return error.code or 0
+    sys.stderr.write('{}\n'.format(error.code))
+    return 1
+
+
+def handle(story, error, connection):
+    """Run the command received on `connection`. Never returns."""
+    code = 1
+    try:
+        message, fds, flags, address = socket.recv_fds(connection, 1, 3)
+        data = json.loads(connection.makefile('rb').readline().decode('utf8'))
+        connection.sendall('{}\n'.format(os.getpid()).encode())
+        open_streams(fds)
+        os.chdir(data['cwd'])
+        os.environ.clear()
+        os.environ.update(data['env'])
+        sys.argv = data['argv']
+        if story is None:
+            # The story failed to load, show why.
+            sys.stderr.write(error)
+        else:
+            story.argv = data['argv']
+            story.activate_language()
+            story.execute()
+            code = 0
+    except SystemExit as e:
+        code = get_exit_code(e)
+    except KeyboardInterrupt:
+        code = 130
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            connection.sendall('{}\n'.format(code).encode())
+        finally:
+            os._exit(0)
+
+
+def reap():
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+
+class Server(object):
+    """
+    Serve the commands of `story` on the Unix socket `address`
+
+    A worker process loads the story and forks for every connection. When
+    a file of the story changes, the worker exits before accepting another
+    connection and a new one is started, so stale modules are never used.
+    """
+
+    interval = 1
+
+    def __init__(self, story, address=None):
+        self.story = story
+        self.address = address or get_address(story)
+        self.roots = get_roots(story)
+        self.listener = None
+
+    def bind(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(self.address):
+            try:
+                listener.connect(self.address)
+            except OSError:
+                # Left behind by a server that didn't stop cleanly.
+                os.unlink(self.address)
+            else:
+                listener.close()
+                raise RuntimeError(
+                    'A server is already running on {}'.format(self.address))
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        os.makedirs(os.path.dirname(self.address), exist_ok=True)
+        listener.bind(self.address)
+        listener.listen(64)
+        self.listener = listener
+
+    def serve_forever(self):
+        self.bind()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        pid = None
+        try:
+            while True:
+                started = time.monotonic()
+                pid = os.fork()
+                if pid == 0:
+                    self.run_worker()
+                os.waitpid(pid, 0)
+                pid = None
+                # Don't spin if the worker keeps failing.
+                time.sleep(max(0, self.interval - time.monotonic() + started))
+        finally:
+            if pid is not None:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            self.listener.close()
+            os.unlink(self.address)
+
+    def run_worker(self):
+        """Serve until the story changes. Never returns."""
+        code = 0
+        try:
+            self.work()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+
+    def load(self):
+        """Return the warmed up story, or None and the error."""
+        try:
+            story = load_story(self.story)()
+            warm_up(story)
+        except Exception:
+            return None, traceback.format_exc()
+        return story, None
+
+    def work(self):
+        snapshot = get_snapshot(self.roots)
+        story, error = self.load()
+        while True:
+            readable, writable, errors = select.select(
+                [self.listener], [], [], self.interval)
+            reap()
+            if get_snapshot(self.roots) != snapshot:
+                return
+            if readable:
+                connection, address = self.listener.accept()
+                if os.fork() == 0:
+                    self.listener.close()
+                    handle(story, error, connection)
+                connection.close()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Keep a story loaded to run its commands quickly.')
+    parser.add_argument('story', help='The story class, as module:Class.')
+    parser.add_argument('--socket', help='Path of the Unix socket.')
+    args = parser.parse_args(argv)
+    server = Server(args.story, args.socket)
+    try:
+        server.serve_forever()
+    except RuntimeError as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
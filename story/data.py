@@ -1,15 +1,35 @@
-import codecs
 import json
 import os
 import sys
+import tempfile
+import time
 
+from .backends import JSONBackend, migrate
 from .translation import DEFAULT_LANGUAGE, activate, add_localedir
 
 
 class DataManager(object):
+    """
+    Progress storage for a story
+
+    Values are read and written through a backend (see `story.backends`).
+    Changes are saved only when `flush()` is called, which happens once at
+    the end of every command or when leaving the manager used as a context
+    manager.
+    """
 
     filename = os.path.expanduser('~/.pyschool')
-    _data = None
+    # Set `backend_class` to SQLiteBackend (and `filename` to a database) to
+    # store the progress in SQLite. The progress found in `legacy_filename`
+    # is imported into a new database.
+    backend_class = JSONBackend
+    legacy_filename = os.path.expanduser('~/.pyschool')
+    # Number of verification results kept, least recently used are dropped.
+    # They're cached apart from the progress, a file per result, in the
+    # directory set by the STORY_RESULTS_DIR environment variable.
+    results_size = 64
+    _backend = None
+    _completed_set = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -19,44 +39,67 @@ class DataManager(object):
         for path in module.__path__:
             add_localedir(path)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self.get_backend()
+        return self._backend
+
+    def get_backend(self):
+        backend = self.backend_class(self.filename)
+        legacy_filename = self.legacy_filename
+        if (not isinstance(backend, JSONBackend) and
+                legacy_filename and legacy_filename != self.filename and
+                not backend.exists() and os.path.exists(legacy_filename)):
+            migrate(JSONBackend(legacy_filename), backend)
+        return backend
+
     def load(self):
-        if self._data is None:
-            filename = self.filename
-            if not os.path.exists(filename):
-                self._data = {}
-            else:
-                try:
-                    with codecs.open(filename, encoding='utf8') as f:
-                        self._data = json.loads(f.read())
-                except:
-                    # TODO: Add error handling
-                    self._data = {}
-        return self._data
+        return self.backend.load()
 
     def save(self):
-        with codecs.open(self.filename, 'w+', encoding='utf8') as f:
-            f.write(json.dumps(self._data))
+        self.backend.save()
+
+    def flush(self):
+        """Save pending changes, if any."""
+        self.backend.flush()
+        # Saving may have merged completions made by other commands.
+        self._completed_set = None
+
+    def reload(self):
+        """Close the backend, the progress is read again when next needed."""
+        if self._backend is not None:
+            self._backend.close()
+        self._backend = None
+        self._completed_set = None
 
     def set_data(self, value):
-        data = self.load()
-        data[self.name] = value
-        self.save()
+        self.backend.set_story(self.name, value)
+        self._completed_set = None
 
     def get_data(self):
-        data = self.load()
-        if self.name not in data:
-            data[self.name] = {}
-        return data[self.name]
+        return self.backend.get_story(self.name)
 
     data = property(get_data, set_data)
 
+    def get_value(self, key, default=None):
+        return self.backend.get(self.name, key, default)
+
+    def set_value(self, key, value):
+        self.backend.set(self.name, key, value)
+
     def set_language(self, language):
-        self.data['language'] = language
-        self.save()
+        self.set_value('language', language)
         self.activate_language()
 
     def get_language(self):
-        return self.data.get('language', DEFAULT_LANGUAGE)
+        return self.get_value('language', DEFAULT_LANGUAGE)
 
     language = property(get_language, set_language)
 
@@ -64,25 +107,100 @@ class DataManager(object):
         activate(self.language)
 
     def set_current(self, current):
-        self.data['current'] = current
-        self.save()
+        self.set_value('current', current)
 
     def get_current(self):
-        return self.data.get('current', None)
+        return self.get_value('current')
 
     current = property(get_current, set_current)
 
     def set_completed(self, value):
         if isinstance(value, str):
-            completed = self.completed
-            if value not in completed:
-                completed.append(value)
+            if value in self.completed_set:
+                return
+            completed = self.completed + [value]
         else:
-            completed = value
-        self.data['completed'] = completed
-        self.save()
+            completed = list(value)
+        self.set_value('completed', completed)
+        self._completed_set = None
 
     def get_completed(self):
-        return self.data.get('completed', [])
+        return self.get_value('completed', [])
 
     completed = property(get_completed, set_completed)
+
+    @property
+    def completed_set(self):
+        """
+        Names of the completed adventures as a set, for membership checks.
+        `completed` keeps the order in which they were completed.
+        """
+        if self._completed_set is None:
+            self._completed_set = frozenset(self.completed)
+        return self._completed_set
+
+    def get_results_dir(self):
+        directory = os.environ.get(
+            'STORY_RESULTS_DIR',
+            os.path.expanduser('~/.cache/pyschool/results'))
+        return os.path.join(directory, self.name)
+
+    def get_result_filename(self, key):
+        return os.path.join(self.get_results_dir(), key + '.json')
+
+    def get_cached_result(self, key):
+        """Return the cached VerificationResult for `key`, if any."""
+        from .runner import VerificationResult
+        filename = self.get_result_filename(key)
+        try:
+            with open(filename, encoding='utf8') as f:
+                result = VerificationResult.from_dict(json.load(f))
+            # The modification time orders the results by last use, a hit
+            # only touches it instead of rewriting anything.
+            touch(filename)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return result
+
+    def cache_result(self, key, result):
+        directory = self.get_results_dir()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf8') as f:
+                    json.dump(result.as_dict(), f)
+                touch(temp)
+                os.replace(temp, self.get_result_filename(key))
+            except:
+                os.unlink(temp)
+                raise
+            self.prune_results(directory)
+        except OSError:
+            # The cache is an optimization, verifying still works without it.
+            pass
+
+    def prune_results(self, directory):
+        """Remove the least recently used results past `results_size`."""
+        results = []
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            filename = os.path.join(directory, name)
+            try:
+                results.append((os.stat(filename).st_mtime_ns, filename))
+            except OSError:
+                pass
+        results.sort()
+        for mtime, filename in results[:-self.results_size]:
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+
+
+def touch(filename):
+    # Explicit times, the file system's own clock may be coarser than the
+    # time between two verifications.
+    now = time.time_ns()
+    os.utime(filename, ns=(now, now))
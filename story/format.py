@@ -1,5 +1,8 @@
+import hashlib
 import os
 import sys
+import tempfile
+from collections import OrderedDict
 
 import pygments
 from pygments.formatters.other import NullFormatter
@@ -107,15 +110,146 @@ class Solarized256Style(Style):
     }
 
 
-if not sys.stdout.isatty():
-    Formatter = NullFormatter
-elif '256color' in os.environ.get('TERM', ''):
-    Formatter = Terminal256Formatter
-else:
-    Formatter = TerminalFormatter
+FORMATTERS = (NullFormatter, TerminalFormatter, Terminal256Formatter)
+
+
+def get_formatter_class(outfile=None):
+    """
+    Choose the formatter for `outfile`, the current standard output by
+    default, and the terminal, which change between the commands run by the
+    daemon.
+    """
+    isatty = getattr(outfile or sys.stdout, 'isatty', None)
+    if isatty is None or not isatty():
+        return NullFormatter
+    if '256color' in os.environ.get('TERM', ''):
+        return Terminal256Formatter
+    return TerminalFormatter
+
+
+# Rendered documents are kept in memory, and on disk too when the
+# STORY_CACHE_DIR environment variable is set.
+CACHE_SIZE = 32
+CACHE_MAX_LENGTH = 256 * 1024
+
+_formatters = {}
+_lexer = None
+_cache = OrderedDict()
+
+
+def get_cache_dir():
+    return os.environ.get('STORY_CACHE_DIR')
+
+
+def get_formatter(formatter_class=None):
+    formatter_class = formatter_class or get_formatter_class()
+    if formatter_class not in _formatters:
+        _formatters[formatter_class] = formatter_class(
+            style=Solarized256Style)
+    return _formatters[formatter_class]
+
+
+def get_lexer():
+    global _lexer
+    if _lexer is None:
+        _lexer = RstLexer(handlecodeblocks=True)
+    return _lexer
+
+
+def get_cache_key(content, formatter_class=None):
+    """Identify the rendered content, the formatter and the style."""
+    return '{}-{}-{}'.format(
+        (formatter_class or get_formatter_class()).__name__,
+        Solarized256Style.__name__,
+        hashlib.sha1(content.encode('utf8')).hexdigest())
+
+
+def read_cache(key):
+    directory = get_cache_dir()
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, key), encoding='utf8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_cache(key, result):
+    directory = get_cache_dir()
+    if directory is None:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as f:
+                f.write(result)
+            os.replace(temp, os.path.join(directory, key))
+        except:
+            os.unlink(temp)
+            raise
+    except OSError:
+        # The cache is an optimization, rendering still works without it.
+        pass
+
+
+def get_cached(key):
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    result = read_cache(key)
+    if result is not None:
+        set_cached(key, result, write=False)
+    return result
+
+
+def set_cached(key, result, write=True):
+    if write:
+        write_cache(key, result)
+    _cache[key] = result
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
 
 
 def highlight(content):
-    formatter = Formatter(style=Solarized256Style)
-    lexer = RstLexer(handlecodeblocks=True)
-    return pygments.highlight(content, lexer, formatter)
+    key = get_cache_key(content)
+    result = get_cached(key)
+    if result is None:
+        result = pygments.highlight(content, get_lexer(), get_formatter())
+        set_cached(key, result)
+    return result
+
+
+class _Tee(object):
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.chunks = []
+
+    def write(self, chunk):
+        self.outfile.write(chunk)
+        self.chunks.append(chunk)
+
+
+def highlight_to(content, outfile):
+    """
+    Write the highlighted content to `outfile` token by token, as the lexer
+    produces them, instead of building the whole result first. Documents
+    longer than CACHE_MAX_LENGTH aren't cached, so no copy of the result is
+    kept in memory. The formatter is chosen for `outfile`.
+    """
+    formatter_class = get_formatter_class(outfile)
+    key = get_cache_key(content, formatter_class)
+    result = get_cached(key)
+    if result is not None:
+        outfile.write(result)
+        return
+    tokens = get_lexer().get_tokens(content)
+    formatter = get_formatter(formatter_class)
+    if len(content) > CACHE_MAX_LENGTH:
+        pygments.format(tokens, formatter, outfile)
+        return
+    tee = _Tee(outfile)
+    pygments.format(tokens, formatter, tee)
+    set_cached(key, ''.join(tee.chunks))
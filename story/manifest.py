@@ -0,0 +1,127 @@
+"""
+Precompiled metadata of the adventures of a story
+"""
+import json
+import os
+import sys
+import tempfile
+
+from .translation import (LANGUAGES, activate, get_catalog_directories,
+                          get_language)
+
+MANIFEST_VERSION = 3
+
+
+def get_mtimes(directory):
+    """Return the modification times of a directory and the files in it."""
+    mtimes = {directory: os.stat(directory).st_mtime}
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            mtimes[entry.path] = entry.stat().st_mtime
+    return mtimes
+
+
+class Manifest(object):
+    """
+    Positions, titles and documents of the adventures, in every language
+
+    For every adventure, the manifest has its position, its title and the
+    paths of its README and SOLUTION documents in every language, and the
+    languages it has its own README in. It's built with `story
+    build-manifest` and lets the read-only commands skip importing the
+    adventure modules and looking for the documents. It's ignored as soon as
+    any file it depends on is added, removed or modified: the files
+    in the adventure directories, the translation catalogs and the story
+    module, which lists the adventures.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._adventures = None
+
+    def load(self):
+        """Return the metadata by adventure name, empty if missing or stale."""
+        if self._adventures is None:
+            self._adventures = {}
+            try:
+                with open(self.filename, encoding='utf8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return self._adventures
+            if (data.get('version') == MANIFEST_VERSION and
+                    self.is_fresh(data['mtimes'])):
+                self._adventures = {
+                    adventure['name']: adventure
+                    for adventure in data['adventures']
+                }
+        return self._adventures
+
+    def get(self, name):
+        return self.load().get(name)
+
+    @staticmethod
+    def is_fresh(mtimes):
+        for path, mtime in mtimes.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def build(self, manager):
+        """Collect the metadata of all the adventures of `manager`."""
+        codes = [code for code, name in LANGUAGES]
+        language = get_language()
+        adventures = []
+        module = sys.modules[manager.__class__.__module__]
+        story_file = os.path.abspath(module.__file__)
+        mtimes = {story_file: os.stat(story_file).st_mtime}
+        for code in codes:
+            for directory in get_catalog_directories(code):
+                mtimes.update(get_mtimes(directory))
+        try:
+            for adventure in manager.adventures:
+                directory = os.path.dirname(adventure.get_path('README.rst'))
+                mtimes.update(get_mtimes(directory))
+                titles = {}
+                files = {}
+                for code in codes:
+                    activate(code)
+                    titles[code] = str(adventure.title)
+                    files[code] = {
+                        name: adventure.find_file(name, code)
+                        for name in ('README', 'SOLUTION')
+                    }
+                adventures.append({
+                    'name': adventure.name,
+                    'position': adventure.position,
+                    'titles': titles,
+                    'languages': [
+                        code for code in codes
+                        if os.path.exists(adventure.get_path(
+                            adventure.files[0].format(
+                                name='README', language=code)))
+                    ],
+                    'files': files,
+                })
+        finally:
+            activate(language)
+        return {
+            'version': MANIFEST_VERSION,
+            'adventures': adventures,
+            'mtimes': mtimes,
+        }
+
+    def save(self, data):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, temp = tempfile.mkstemp(
+            dir=directory, prefix='.manifest-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as f:
+                f.write(json.dumps(data))
+            os.replace(temp, self.filename)
+        except:
+            os.unlink(temp)
+            raise
+        self._adventures = None
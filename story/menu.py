@@ -3,6 +3,7 @@ Handles the Main Menu of the story
 """
 import curses.panel
 import os
+import sys
 
 
 from .translation import gettext as _, LANGUAGES
@@ -96,20 +97,32 @@ class Level(list):
             self.panel.hide()
 
     def render(self):
+        """
+        Draw the items marked as dirty, then send the changes to the
+        terminal in a single update.
+        """
         self.ensure_ui()
 
         position = 0
         for item in self:
-            item.render(
-                self.window,
-                self.padding_x,
-                self.padding_y + position,
-                self.width
-            )
+            if item.dirty:
+                item.render(
+                    self.window,
+                    self.padding_x,
+                    self.padding_y + position,
+                    self.width
+                )
+                item.dirty = False
             position += item.size
 
+        self.window.noutrefresh()
         curses.doupdate()
 
+    def invalidate(self):
+        """Mark every item to be drawn again."""
+        for item in self:
+            item.dirty = True
+
     def wait(self):
         {
             Keys.ESCAPE: lambda: self.menu.exit(),
@@ -204,6 +217,10 @@ class Menu():
     def back(self):
         self.pop()
 
+    def invalidate(self):
+        for level in self.levels:
+            level.invalidate()
+
     def exit(self):
         if self.running:
             curses.endwin()
@@ -214,6 +231,8 @@ class Item(object):
 
     selectable = False
     size = 1
+    # Only dirty items are drawn when their level is rendered.
+    dirty = True
 
     def __init__(self, menu):
         self.menu = menu
@@ -273,7 +292,17 @@ class TitleItem(TextItem):
 class SelectableMixin(object):
 
     selectable = True
-    selected = False
+    _selected = False
+
+    @property
+    def selected(self):
+        return self._selected
+
+    @selected.setter
+    def selected(self, selected):
+        if selected != self._selected:
+            self._selected = selected
+            self.dirty = True
 
     def get_text(self, width):
         text = super().get_text(width).upper()
@@ -321,7 +350,7 @@ class AdventureItem(SelectableMixin, TextItem):
     def action(self):
         self.menu.exit()
         self.menu.story.set_current(self.adventure.name)
-        print(self.adventure.problem_formatted)
+        self.adventure.write_problem(sys.stdout)
 
 
 class ChooseLanguageItem(SelectableMixin, TextItem):
@@ -373,6 +402,8 @@ class LanguageItem(SelectableMixin, TextItem):
 
     def action(self):
         self.menu.story.language = self.code
+        # Every text is translated again
+        self.menu.invalidate()
         self.menu.back()
 
 
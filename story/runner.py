@@ -0,0 +1,394 @@
+"""
+Runs adventure tests isolated in worker processes
+"""
+import codecs
+import multiprocessing
+import os
+import runpy
+import select
+import signal
+import subprocess
+import sys
+import sysconfig
+import time
+import traceback
+from multiprocessing.connection import wait
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+from .translation import gettext as _
+
+
+class VerificationResult(object):
+    """Outcome of testing a file against an adventure."""
+
+    PASSED = 'passed'
+    FAILED = 'failed'
+    TIMEOUT = 'timeout'
+    ERROR = 'error'
+
+    def __init__(self, status, message='', duration=None):
+        self.status = status
+        self.message = message
+        self.duration = duration
+
+    def __repr__(self):
+        return '<VerificationResult {}>'.format(self.status)
+
+    @property
+    def passed(self):
+        return self.status == self.PASSED
+
+    def as_dict(self):
+        return {
+            'status': self.status,
+            'message': self.message,
+            'duration': self.duration,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['status'], data['message'], data['duration'])
+
+
+def get_context():
+    # Forked workers inherit the adventure, nothing needs to be pickled.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def apply_limits(adventure):
+    set_limits(adventure.cpu_time_limit, adventure.memory_limit)
+
+
+def set_limits(cpu_time_limit, memory_limit):
+    if resource is None:
+        return
+    if cpu_time_limit:
+        limit = int(cpu_time_limit)
+        resource.setrlimit(resource.RLIMIT_CPU, (limit, limit + 1))
+    if memory_limit:
+        limit = int(memory_limit)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_in_process(adventure, file):
+    """Test `file` in this process, returning the status and a message."""
+    from .adventures import AdventureVerificationError
+    try:
+        adventure.test(file)
+    except AdventureVerificationError as e:
+        return VerificationResult.FAILED, str(e)
+    except MemoryError:
+        message = _('The memory limit was reached.')
+        return VerificationResult.ERROR, str(message)
+    except Exception:
+        return VerificationResult.ERROR, traceback.format_exc()
+    return VerificationResult.PASSED, ''
+
+
+def work(adventure, file, connection):
+    apply_limits(adventure)
+    connection.send(run_in_process(adventure, file))
+    connection.close()
+
+
+class Job(object):
+
+    def __init__(self, adventure, file):
+        self.adventure = adventure
+        self.file = file
+        self.process = None
+        self.connection = None
+        self.started = None
+        self.deadline = None
+
+    def start(self, context):
+        receiver, sender = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=work, args=(self.adventure, self.file, sender))
+        self.started = time.monotonic()
+        if self.adventure.time_limit:
+            self.deadline = self.started + self.adventure.time_limit
+        self.process.start()
+        # Only the worker keeps the sending end, so a crash is seen as EOF.
+        sender.close()
+        self.connection = receiver
+
+    def finish(self):
+        duration = time.monotonic() - self.started
+        try:
+            status, message = self.connection.recv()
+        except EOFError:
+            self.process.join()
+            if self.process.exitcode == -getattr(signal, 'SIGXCPU', -1):
+                status = VerificationResult.TIMEOUT
+                message = str(_('The verification took too long.'))
+            else:
+                status = VerificationResult.ERROR
+                message = str(_('The verification stopped unexpectedly.'))
+        self.close()
+        return VerificationResult(status, message, duration)
+
+    def timeout(self):
+        self.process.kill()
+        self.close()
+        return VerificationResult(
+            VerificationResult.TIMEOUT,
+            str(_('The verification took too long.')),
+            time.monotonic() - self.started)
+
+    def close(self):
+        self.process.join()
+        self.connection.close()
+
+
+def run_tests(jobs, workers=None):
+    """
+    Test many (adventure, file) pairs, each in its own worker process and at
+    most `workers` at a time. Yields ((adventure, file), result) as the
+    tests finish.
+    """
+    context = get_context()
+    workers = workers or os.cpu_count() or 1
+    pending = iter(jobs)
+    running = {}
+    while True:
+        while len(running) < workers:
+            item = next(pending, None)
+            if item is None:
+                break
+            job = Job(*item)
+            job.start(context)
+            running[job.connection] = job
+        if not running:
+            return
+        deadlines = [job.deadline for job in running.values() if job.deadline]
+        timeout = None
+        if deadlines:
+            timeout = max(0, min(deadlines) - time.monotonic())
+        for connection in wait(list(running), timeout):
+            job = running.pop(connection)
+            yield (job.adventure, job.file), job.finish()
+        now = time.monotonic()
+        for connection, job in list(running.items()):
+            if job.deadline and job.deadline <= now:
+                del running[connection]
+                yield (job.adventure, job.file), job.timeout()
+
+
+def run_test(adventure, file):
+    """Test `file` against `adventure` in a worker process."""
+    for item, result in run_tests([(adventure, file)], workers=1):
+        return result
+
+
+class RunResult(object):
+    """Outcome of running a learner's program."""
+
+    def __init__(self, returncode, timed_out=False, duration=None):
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.duration = duration
+
+    def __repr__(self):
+        return '<RunResult {}>'.format(
+            'timeout' if self.timed_out else self.returncode)
+
+
+def reset_imports(file):
+    """
+    Leave the import path and modules a new interpreter running `file`
+    would start with: its directory first, and only the standard library
+    imported, so the learner's modules aren't shadowed by the CLI's.
+    """
+    paths = sysconfig.get_paths()
+    stdlib = tuple(
+        os.path.join(paths[name], '') for name in ('stdlib', 'platstdlib'))
+    packages = tuple(
+        os.path.join(paths[name], '') for name in ('purelib', 'platlib'))
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None)
+        if filename is None:
+            continue
+        filename = os.path.abspath(filename)
+        if not filename.startswith(stdlib) or filename.startswith(packages):
+            del sys.modules[name]
+    sys.path[0] = os.path.dirname(os.path.abspath(file))
+
+
+def exec_program(file, stdin, stdout, cpu_time_limit, memory_limit):
+    """Run `file` as __main__ in this, forked, process. Never returns."""
+    code = 1
+    try:
+        reset_imports(file)
+        os.dup2(stdin, 0)
+        os.dup2(stdout, 1)
+        os.dup2(stdout, 2)
+        # Only the standard descriptors stay open, so closing them is EOF.
+        for descriptor in {stdin, stdout} - {0, 1, 2}:
+            os.close(descriptor)
+        sys.stdin = open(0, encoding='utf8', closefd=False)
+        sys.stdout = open(1, 'w', encoding='utf8', closefd=False)
+        sys.stderr = open(2, 'w', encoding='utf8', closefd=False)
+        set_limits(cpu_time_limit, memory_limit)
+        sys.argv = [file]
+        runpy.run_path(file, run_name='__main__')
+        code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            sys.stderr.write('{}\n'.format(e.code))
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def start_program(file, cpu_time_limit, memory_limit, warm):
+    """Start `file`, returning its pid, stdin and output descriptors."""
+    stdin_read, stdin_write = os.pipe()
+    output_read, output_write = os.pipe()
+    if warm and hasattr(os, 'fork'):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.close(stdin_write)
+            os.close(output_read)
+            exec_program(
+                file, stdin_read, output_write, cpu_time_limit, memory_limit)
+        process = pid
+    else:
+        process = subprocess.Popen(
+            [sys.executable, file],
+            stdin=stdin_read, stdout=output_write, stderr=output_write,
+            preexec_fn=lambda: set_limits(cpu_time_limit, memory_limit))
+    os.close(stdin_read)
+    os.close(output_write)
+    return process, stdin_write, output_read
+
+
+def get_returncode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def wait_program(process, deadline=None):
+    """
+    Wait for the program to finish, until `deadline` if given. Return its
+    exit code, or None if it's still running.
+    """
+    if isinstance(process, subprocess.Popen):
+        timeout = None
+        if deadline is not None:
+            timeout = max(0, deadline - time.monotonic())
+        try:
+            return process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            return None
+    if deadline is None:
+        return get_returncode(os.waitpid(process, 0)[1])
+    # Poll like Popen.wait does, there's no waitpid with a timeout.
+    delay = 0.0005
+    while True:
+        pid, status = os.waitpid(process, os.WNOHANG)
+        if pid:
+            return get_returncode(status)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        delay = min(delay * 2, remaining, 0.05)
+        time.sleep(delay)
+
+
+def stop_program(process, deadline=None):
+    """
+    Wait for the program to finish, killing it if it's still running at
+    `deadline`. Return its exit code, or None if it was killed.
+    """
+    returncode = wait_program(process, deadline)
+    if returncode is not None:
+        return returncode
+    if isinstance(process, subprocess.Popen):
+        process.kill()
+        process.wait()
+    else:
+        os.kill(process, signal.SIGKILL)
+        os.waitpid(process, 0)
+    return None
+
+
+def run_program(file, input='', outfile=None, time_limit=None,
+                cpu_time_limit=None, memory_limit=None, warm=True):
+    """
+    Run the learner's program `file` feeding it `input`, and write what it
+    prints to `outfile` as it's printed.
+
+    With `warm`, the program runs in a fork of the current process, which
+    has the interpreter already started, instead of a new interpreter.
+    The time limit holds until the program exits, even after it closes its
+    output.
+    """
+    outfile = outfile or sys.stdout
+    decoder = codecs.getincrementaldecoder('utf8')(errors='replace')
+    start = time.monotonic()
+    deadline = start + time_limit if time_limit else None
+    process, stdin, output = start_program(
+        file, cpu_time_limit, memory_limit, warm)
+    pending = input.encode('utf8')
+    if not pending:
+        os.close(stdin)
+        stdin = None
+    timed_out = False
+    try:
+        while output is not None:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    timed_out = True
+                    break
+            writers = [stdin] if stdin is not None else []
+            readable, writable, errors = select.select(
+                [output], writers, [], timeout)
+            if writable:
+                try:
+                    written = os.write(stdin, pending[:select.PIPE_BUF])
+                    pending = pending[written:]
+                except BrokenPipeError:
+                    pending = b''
+                if not pending:
+                    os.close(stdin)
+                    stdin = None
+            if readable:
+                chunk = os.read(output, 4096)
+                if not chunk:
+                    os.close(output)
+                    output = None
+                    break
+                outfile.write(decoder.decode(chunk))
+                outfile.flush()
+    finally:
+        for descriptor in (stdin, output):
+            if descriptor is not None:
+                os.close(descriptor)
+        # Past the deadline the program is killed right away.
+        returncode = stop_program(
+            process, time.monotonic() if timed_out else deadline)
+    if returncode is None or returncode == -getattr(signal, 'SIGXCPU', -1):
+        timed_out = True
+    outfile.write(decoder.decode(b'', final=True))
+    return RunResult(
+        None if timed_out else returncode, timed_out,
+        time.monotonic() - start)
@@ -0,0 +1,227 @@
+"""
+Completion statistics over the progress files of many learners
+
+The progress files under a directory, JSON documents or SQLite databases as
+written by `story.backends`, are read in a thread pool. What's needed from
+each file, the learner's language and completed adventures, is cached along
+with the file's modification time and size, so the next run only reads the
+files that changed.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import pathname2url
+
+from .translation import DEFAULT_LANGUAGE
+
+CACHE_VERSION = 1
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+# Written next to the progress files by JSONBackend.
+IGNORED_SUFFIXES = ('.lock', '.tmp')
+
+
+def get_cache_dir():
+    return os.environ.get(
+        'STORY_STATS_DIR', os.path.expanduser('~/.cache/pyschool'))
+
+
+def get_cache_filename(directory, story):
+    digest = hashlib.sha1(os.path.abspath(directory).encode('utf8'))
+    return os.path.join(get_cache_dir(), 'stats-{}-{}.json'.format(
+        story, digest.hexdigest()[:12]))
+
+
+def find_files(directory):
+    """Yield the path and stat of every progress file under `directory`."""
+    for root, directories, files in os.walk(directory):
+        for name in files:
+            if name.endswith(IGNORED_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            try:
+                yield path, os.stat(path)
+            except OSError:
+                pass
+
+
+def read_sqlite(path, story):
+    uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(path)))
+    connection = sqlite3.connect(uri, uri=True)
+    try:
+        rows = connection.execute(
+            'SELECT key, value FROM progress WHERE story = ?', (story,))
+        return {key: json.loads(value) for key, value in rows}
+    finally:
+        connection.close()
+
+
+def read_progress(path, story):
+    """
+    Return the language and completed adventures of `story` in the progress
+    file `path`, or None if it has no progress of the story.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(len(SQLITE_HEADER))
+            # SQLite databases are queried, only JSON files are read whole.
+            if header != SQLITE_HEADER:
+                content = header + f.read()
+        if header == SQLITE_HEADER:
+            data = read_sqlite(path, story)
+        else:
+            data = json.loads(content.decode('utf8')).get(story)
+        if not data:
+            return None
+        if not isinstance(data, dict):
+            raise ValueError('Invalid progress')
+        language = data.get('language') or DEFAULT_LANGUAGE
+        completed = data.get('completed') or []
+        if not isinstance(language, str) or not isinstance(completed, list):
+            raise ValueError('Invalid progress')
+        # Hashable names only, they're counted.
+        completed = [name for name in completed if isinstance(name, str)]
+    except (OSError, ValueError, AttributeError, sqlite3.Error):
+        # Not a progress file
+        return None
+    return {'language': language, 'completed': completed}
+
+
+class Stats(object):
+    """
+    Completion counts of the `adventures` of a story, given by name in
+    order, aggregated one learner's progress at a time.
+    """
+
+    def __init__(self, adventures):
+        self.adventures = list(adventures)
+        self.learners = 0
+        self.completed = Counter()
+        self.languages = {}
+        # Learners by number of adventures completed in order, from the first
+        self.reached = Counter()
+        # Files read, and files whose progress came from the cache
+        self.read = 0
+        self.cached = 0
+
+    def add(self, progress):
+        completed = set(progress['completed'])
+        self.learners += 1
+        self.completed.update(completed)
+        language = self.languages.setdefault(
+            progress['language'], {'learners': 0, 'completed': Counter()})
+        language['learners'] += 1
+        language['completed'].update(completed)
+        reached = 0
+        for name in self.adventures:
+            if name not in completed:
+                break
+            reached += 1
+        self.reached[reached] += 1
+
+    def get_funnel(self):
+        """
+        Return how many learners reached every adventure, having completed it
+        and all the previous ones, and how many dropped off right before it.
+        """
+        funnel = []
+        previous = remaining = self.learners
+        for position, name in enumerate(self.adventures, 1):
+            remaining -= self.reached[position - 1]
+            funnel.append({
+                'name': name,
+                'reached': remaining,
+                'dropped': previous - remaining,
+            })
+            previous = remaining
+        return funnel
+
+    def as_dict(self):
+        return {
+            'learners': self.learners,
+            'adventures': [
+                {
+                    'name': name,
+                    'position': position,
+                    'completed': self.completed[name],
+                }
+                for position, name in enumerate(self.adventures, 1)
+            ],
+            'languages': {
+                code: {
+                    'learners': language['learners'],
+                    'completed': {
+                        name: language['completed'][name]
+                        for name in self.adventures
+                    },
+                }
+                for code, language in sorted(self.languages.items())
+            },
+            'funnel': self.get_funnel(),
+            'files': {'read': self.read, 'cached': self.cached},
+        }
+
+
+def load_cache(filename, story):
+    try:
+        with open(filename, encoding='utf8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != CACHE_VERSION or data.get('story') != story:
+        return {}
+    return data['files']
+
+
+def save_cache(filename, story, files):
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.stats-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf8') as f:
+            f.write(json.dumps({
+                'version': CACHE_VERSION,
+                'story': story,
+                'files': files,
+            }))
+        os.replace(temp, filename)
+    except:
+        os.unlink(temp)
+        raise
+
+
+def collect(directory, story, adventures, cache_filename=None, jobs=None):
+    """
+    Return the Stats of `story` over the progress files under `directory`.
+    With `cache_filename`, only the files changed since the previous run
+    are read.
+    """
+    cached = load_cache(cache_filename, story) if cache_filename else {}
+    files = {}
+    pending = []
+    for path, stat in find_files(directory):
+        key = [stat.st_mtime_ns, stat.st_size]
+        entry = cached.get(path)
+        if entry is not None and entry[:2] == key:
+            files[path] = entry
+        else:
+            pending.append((path, key))
+
+    stats = Stats(adventures)
+    stats.cached = len(files)
+    stats.read = len(pending)
+    with ThreadPoolExecutor(jobs) as executor:
+        progresses = executor.map(
+            lambda item: read_progress(item[0], story), pending)
+        for (path, key), progress in zip(pending, progresses):
+            files[path] = key + [progress]
+    for mtime, size, progress in files.values():
+        if progress is not None:
+            stats.add(progress)
+    if cache_filename:
+        save_cache(cache_filename, story, files)
+    return stats
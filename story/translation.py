@@ -1,13 +1,22 @@
 import os
-from threading import local
+from collections import ChainMap
+from contextlib import contextmanager
+from contextvars import ContextVar
 import gettext as gettext_module
 
+from .catalog import MappedCatalog, compile_catalog
 from .utils import lazy
 
 
 _localedirs = [os.path.dirname(__file__)]
+_localedir_set = set(_localedirs)
+# Parsed catalogs by (locale directory, language), used when the catalogs are
+# merged in memory.
+_catalogs = {}
 _translations = {}
-_active = local()
+# The active translation is held per context, so threads and asyncio tasks
+# serving different languages don't mix them up.
+_active = ContextVar('story_translation', default=None)
 _default = None
 
 DEFAULT_LANGUAGE = 'en'
@@ -21,9 +30,19 @@ class Translations(gettext_module.GNUTranslations):
     objects by merging their catalogs. It will construct an object for the
     requested language and add a fallback to the default language, if it's
     different from the requested language.
+
+    When `compiled` is set, the catalogs are instead merged into a single
+    compiled file (see `story.catalog`) which is memory mapped. If it can't
+    be written or mapped, the catalogs are merged in memory.
+
+    Locale directories are merged lazily, by `update()`, the first time the
+    translation is used after they have been added. Compiled catalogs of
+    directories added later are mapped on their own and looked up first,
+    so an update never compiles the previous directories again.
     """
 
     domain = 'pyschool'
+    compiled = True
 
     def __init__(self, language):
         super().__init__()
@@ -31,13 +50,13 @@ class Translations(gettext_module.GNUTranslations):
         self.language = language
         self.localedirs = []
         self._catalog = None
+        # Incremented on every merge, so lazy translations know when to
+        # translate again.
+        self.revision = 0
         # If a language doesn't have a catalog, use the Germanic default for
         # pluralization: anything except one is pluralized.
         self.plural = lambda n: int(n != 1)
 
-        for localedir in _localedirs:
-            self.add_localedir_translations(localedir)
-
     def __repr__(self):
         return '<Translations lang:%s>' % self.language
 
@@ -49,24 +68,79 @@ class Translations(gettext_module.GNUTranslations):
         Using param `use_null_fallback` to avoid confusion with any other
         references to 'fallback'.
         """
-        use_null_fallback = False
         return gettext_module.translation(
             domain=self.domain,
             localedir=localedir,
             languages=[self.language],
-            codeset='utf-8',
             fallback=use_null_fallback)
 
-    def add_localedir_translations(self, localedir):
-        """Merge translations from localedir."""
-        global _localedirs
-        if localedir in self.localedirs:
+    def update(self):
+        """Merge the locale directories added since the last update."""
+        if len(self.localedirs) == len(_localedirs):
+            return self
+        # _localedirs only grows, the new directories are at the end.
+        localedirs = _localedirs[len(self.localedirs):]
+        self.localedirs.extend(localedirs)
+        if self.compiled:
+            self.load_compiled(localedirs)
+        else:
+            for localedir in localedirs:
+                self.merge_localedir(localedir)
+        return self
+
+    def load_compiled(self, localedirs):
+        """
+        Map the catalog compiled from `localedirs`, over the catalogs mapped
+        before.
+        """
+        try:
+            filename = compile_catalog(self.domain, self.language, localedirs)
+            catalog = MappedCatalog(filename) if filename else None
+        except (OSError, ValueError):
+            # Compiled catalogs can't be written or mapped, merge them in
+            # memory.
+            self.compiled = False
+            self._catalog = None
+            for localedir in self.localedirs:
+                self.merge_localedir(localedir)
             return
-        self.localedirs.append(localedir)
-        full_localedir = os.path.join(localedir, 'locale')
-        if os.path.exists(full_localedir):
-            translation = self._new_gnu_trans(full_localedir)
-            self.merge(translation)
+        if catalog is None:
+            if self._catalog is None:
+                self._catalog = {}
+            return
+        if not self._catalog:
+            self._catalog = catalog
+            self.parse_info(catalog.get('', ''))
+        elif isinstance(self._catalog, ChainMap):
+            self._catalog = self._catalog.new_child(catalog)
+        else:
+            self._catalog = ChainMap(catalog, self._catalog)
+        self.revision += 1
+
+    def parse_info(self, header):
+        """Read the metadata and plural forms from a catalog header."""
+        self._info = {}
+        for line in header.split('\n'):
+            if ':' not in line:
+                continue
+            key, value = line.split(':', 1)
+            key = key.strip().lower()
+            value = value.strip()
+            self._info[key] = value
+            if key == 'plural-forms':
+                plural = value.split(';')[1].split('plural=')[1]
+                self.plural = gettext_module.c2py(plural)
+
+    def merge_localedir(self, localedir):
+        key = (localedir, self.language)
+        if key not in _catalogs:
+            full_localedir = os.path.join(localedir, 'locale')
+            if os.path.exists(full_localedir):
+                _catalogs[key] = self._new_gnu_trans(full_localedir)
+            else:
+                _catalogs[key] = None
+        if _catalogs[key] is not None:
+            self.merge(_catalogs[key])
 
     def merge(self, other):
         """Merge another translation into this catalog."""
@@ -79,6 +153,7 @@ class Translations(gettext_module.GNUTranslations):
             self._catalog = other._catalog.copy()
         else:
             self._catalog.update(other._catalog)
+        self.revision += 1
 
 
 def translation(language):
@@ -94,11 +169,11 @@ def translation(language):
 def activate(language):
     """
     Fetch the translation object for a given language and install it as the
-    current translation object for the current thread.
+    current translation object for the current thread or task.
     """
     if not language:
         return
-    _active.value = translation(language)
+    _active.set(translation(language))
 
 
 def deactivate():
@@ -106,13 +181,28 @@ def deactivate():
     Uninstall the active translation object so that further _() calls resolve
     to the default translation object.
     """
-    if hasattr(_active, 'value'):
-        del _active.value
+    _active.set(None)
+
+
+@contextmanager
+def override(language):
+    """
+    Activate `language` (or deactivate translations if it's None) within a
+    block, restoring the previous translation object on exit.
+    """
+    if language:
+        token = _active.set(translation(language))
+    else:
+        token = _active.set(None)
+    try:
+        yield
+    finally:
+        _active.reset(token)
 
 
 def get_language():
     """Return the currently selected language."""
-    t = getattr(_active, 'value', None)
+    t = _active.get()
     if t is not None:
         try:
             return t.language
@@ -122,29 +212,57 @@ def get_language():
 
 
 def add_localedir(localedir):
-    global _translations
-    global _localedirs
-    if localedir in _localedirs:
+    """
+    Add the translations of a locale directory. They're merged into each
+    translation object the next time it's used.
+    """
+    if localedir in _localedir_set:
         return
+    _localedir_set.add(localedir)
     _localedirs.append(localedir)
-    for translation in _translations.values():
-        translation.add_localedir_translations(localedir)
 
 
-def gettext(message):
+def get_catalog_directories(language):
+    """Return the existing directories of the catalogs of `language`."""
+    directories = []
+    for localedir in _localedirs:
+        directory = os.path.join(localedir, 'locale', language, 'LC_MESSAGES')
+        if os.path.isdir(directory):
+            directories.append(directory)
+    return directories
+
+
+def get_translation():
     """
-    Translate the 'message' string. It uses the current thread to find the
-    translation object to use. If no current translation is activated, the
-    message will be run through the default translation object.
+    Return the translation object of the current thread or task, or the
+    default translation object if no current translation is activated.
     """
     global _default
     _default = _default or translation(DEFAULT_LANGUAGE)
-    translation_object = getattr(_active, 'value', _default)
-    result = translation_object.gettext(message)
+    return (_active.get() or _default).update()
+
+
+def get_translation_key():
+    """
+    Identify the catalog gettext would use now. Changes when another
+    language is activated or when new translations are merged.
+    """
+    translation_object = get_translation()
+    return translation_object, translation_object.revision
+
+
+def gettext(message):
+    """
+    Translate the 'message' string. It uses the current thread or task to
+    find the translation object to use. If no current translation is
+    activated, the message will be run through the default translation
+    object.
+    """
+    result = get_translation().gettext(message)
     return result
 
 
-gettext = lazy(gettext, str)
+gettext = lazy(gettext, str, key=get_translation_key)
 
 
 LANGUAGES = [
@@ -1,4 +1,4 @@
-from functools import total_ordering, wraps
+from functools import lru_cache, total_ordering, wraps
 
 
 class Promise:
@@ -6,15 +6,34 @@ class Promise:
     Base class for the proxy class created in the closure of the lazy function.
     It's used to recognize promises in code.
     """
-    pass
+    __slots__ = ()
 
 
-def lazy(func, *resultclasses):
+def lazy(func, *resultclasses, key=None):
     """
     Turn any callable into a lazy evaluated callable. result classes or types
     is required -- at least one is needed so that the automatic forcing of
     the lazy evaluation code is triggered. Results are not memoized; the
-    function is evaluated on every access.
+    function is evaluated on every access, unless `key` is given: a callable
+    returning what the result depends on. The result is then reused as long
+    as `key()` returns an equal value.
+    """
+    proxy_class = _proxy_class(func, resultclasses, key)
+
+    @wraps(func)
+    def __wrapper__(*args, **kw):
+        # Creates the proxy object, instead of the actual value.
+        return proxy_class(args, kw)
+
+    return __wrapper__
+
+
+@lru_cache(maxsize=None)
+def _proxy_class(func, resultclasses, key):
+    """
+    Build and prepare the proxy class returned by lazy(). It's done once and
+    shared by every lazy callable of the same function, result classes and
+    key.
     """
 
     @total_ordering
@@ -24,14 +43,12 @@ def lazy(func, *resultclasses):
         called on the result of that function. The function is not evaluated
         until one of the methods on the result is called.
         """
-        __prepared = False
+        __slots__ = ('__args', '__kw', '__key', '__value')
 
         def __init__(self, args, kw):
             self.__args = args
             self.__kw = kw
-            if not self.__prepared:
-                self.__prepare_class__()
-            self.__prepared = True
+            self.__key = None
 
         def __reduce__(self):
             return (
@@ -42,6 +59,15 @@ def lazy(func, *resultclasses):
         def __repr__(self):
             return repr(self.__cast())
 
+        def __evaluate(self):
+            if key is None:
+                return func(*self.__args, **self.__kw)
+            current = key()
+            if self.__key is None or self.__key != current:
+                self.__value = func(*self.__args, **self.__kw)
+                self.__key = current
+            return self.__value
+
         @classmethod
         def __prepare_class__(cls):
             for resultclass in resultclasses:
@@ -68,18 +94,18 @@ def lazy(func, *resultclasses):
             def __wrapper__(self, *args, **kw):
                 # Automatically triggers the evaluation of a lazy value and
                 # applies the given magic method of the result type.
-                res = func(*self.__args, **self.__kw)
+                res = self.__evaluate()
                 return getattr(res, method_name)(*args, **kw)
             return __wrapper__
 
         def __text_cast(self):
-            return func(*self.__args, **self.__kw)
+            return self.__evaluate()
 
         def __bytes_cast(self):
-            return bytes(func(*self.__args, **self.__kw))
+            return bytes(self.__evaluate())
 
         def __bytes_cast_encoded(self):
-            return func(*self.__args, **self.__kw).encode()
+            return self.__evaluate().encode()
 
         def __cast(self):
             if self._delegate_bytes:
@@ -87,7 +113,7 @@ def lazy(func, *resultclasses):
             elif self._delegate_text:
                 return self.__text_cast()
             else:
-                return func(*self.__args, **self.__kw)
+                return self.__evaluate()
 
         def __str__(self):
             # object defines __str__(), so __prepare_class__() won't overload
@@ -119,12 +145,8 @@ def lazy(func, *resultclasses):
             memo[id(self)] = self
             return self
 
-    @wraps(func)
-    def __wrapper__(*args, **kw):
-        # Creates the proxy object, instead of the actual value.
-        return __proxy__(args, kw)
-
-    return __wrapper__
+    __proxy__.__prepare_class__()
+    return __proxy__
 
 
 def _lazy_proxy_unpickle(func, args, kwargs, *resultclasses):
@@ -0,0 +1,133 @@
+"""
+Watches files for changes, with inotify where available
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT = struct.Struct('iIII')
+
+
+class PollingWatcher(object):
+    """Notice changes by comparing the modification time of the file."""
+
+    interval = 0.5
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = self.get_mtime()
+
+    def get_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def wait(self, timeout=None):
+        """Wait for a change for up to `timeout` seconds, return if any."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            mtime = self.get_mtime()
+            if mtime != self.mtime:
+                self.mtime = mtime
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(self.interval, remaining))
+            else:
+                time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Notice changes with inotify. The directory is watched, so files saved by
+    writing a new file and renaming it over the old one are noticed too.
+    """
+
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.fsencode(os.path.basename(path))
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), self.mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed')
+
+    def read_names(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            names.append(data[offset:offset + length].rstrip(b'\x00'))
+            offset += length
+        return names
+
+    def wait(self, timeout=None):
+        """Wait for a change for up to `timeout` seconds, return if any."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            readable, writable, errors = select.select(
+                [self.fd], [], [], remaining)
+            if not readable:
+                return False
+            if self.name in self.read_names():
+                return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher(path):
+    try:
+        return InotifyWatcher(path)
+    except (OSError, AttributeError, TypeError):
+        # No inotify on this system
+        return PollingWatcher(path)
+
+
+def watch(path, callback, debounce=0.2, watcher=None):
+    """
+    Call `callback` now and every time `path` changes. Changes are debounced:
+    the callback waits until the file has been quiet for `debounce`
+    seconds, so an editor saving in several writes triggers a single call.
+    """
+    watcher = watcher or get_watcher(path)
+    try:
+        callback()
+        while True:
+            watcher.wait()
+            while watcher.wait(debounce):
+                pass
+            callback()
+    finally:
+        watcher.close()
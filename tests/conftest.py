@@ -0,0 +1,16 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def catalog_dir(tmpdir_factory, monkeypatch):
+    # Compiled catalogs go to a temporary directory, never the user's cache.
+    directory = tmpdir_factory.getbasetemp().join('catalogs')
+    monkeypatch.setenv('STORY_CATALOG_DIR', str(directory))
+
+
+@pytest.fixture(autouse=True)
+def results_dir(tmpdir_factory, monkeypatch):
+    # Verification results are cached per test.
+    directory = tmpdir_factory.mktemp('results')
+    monkeypatch.setenv('STORY_RESULTS_DIR', str(directory))
+    return directory
@@ -1,4 +1,11 @@
-from story.adventures import BaseAdventure
+import os
+import sys
+import types
+
+import pytest
+
+from story.adventures import AdventureManager, BaseAdventure
+from story.translation import activate, get_language
 
 
 class ExampleAdventure(BaseAdventure):
@@ -6,5 +13,149 @@ class ExampleAdventure(BaseAdventure):
     pass
 
 
+def make_module(name):
+    adventure_class = type('Adventure', (BaseAdventure,), {
+        '__module__': 'example.{}'.format(name)})
+    return types.SimpleNamespace(Adventure=adventure_class)
+
+
 def test_adventure_name():
     assert ExampleAdventure(None).name == 'test_adventures'
+
+
+class TestAdventureManager(object):
+
+    def test_get_adventure(self):
+        class Manager(AdventureManager):
+            adventures = [make_module('first'), make_module('second')]
+
+        manager = Manager()
+        adventure = manager.get_adventure('second')
+        assert adventure is manager.adventures[1]
+        assert adventure.position == 2
+        assert manager.get_adventure('third') is None
+
+    def test_duplicated_name(self):
+        class Manager(AdventureManager):
+            adventures = [make_module('first'), make_module('first')]
+
+        with pytest.raises(ValueError):
+            Manager()
+
+    def test_lazy_adventure(self, tmpdir, monkeypatch):
+        package = tmpdir.mkdir('lazy_story')
+        package.join('__init__.py').write('')
+        package.join('second.py').write(
+            'from story.adventures import BaseAdventure\n'
+            'class Adventure(BaseAdventure):\n'
+            '    title = "Second"\n')
+        monkeypatch.syspath_prepend(str(tmpdir))
+
+        class Manager(AdventureManager):
+            adventures = [make_module('first'), 'lazy_story.second']
+            completed_set = frozenset(['second'])
+
+        manager = Manager()
+        adventure = manager.get_adventure('second')
+        assert adventure.position == 2
+        assert adventure.completed
+        assert 'lazy_story.second' not in sys.modules
+        assert adventure.title == 'Second'
+        assert 'lazy_story.second' in sys.modules
+
+    def test_manifest(self, tmpdir, monkeypatch):
+        package = tmpdir.mkdir('manifest_story')
+        package.join('__init__.py').write('')
+        adventure = package.mkdir('first')
+        adventure.join('__init__.py').write(
+            'from story.adventures import BaseAdventure\n'
+            'class Adventure(BaseAdventure):\n'
+            '    title = "First"\n')
+        adventure.join('README.rst').write('First')
+        adventure.join('README.es.rst').write('Primera')
+        monkeypatch.syspath_prepend(str(tmpdir))
+        monkeypatch.setattr('story.manifest.activate', lambda language: None)
+
+        class Manager(AdventureManager):
+            adventures = ['manifest_story.first']
+            manifest_filename = str(tmpdir.join('manifest.json'))
+            language = 'en'
+
+        manager = Manager()
+        manager.manifest.save(manager.manifest.build(manager))
+        metadata = manager.manifest.get('first')
+        assert metadata['position'] == 1
+        assert metadata['titles']['en'] == 'First'
+        assert metadata['languages'] == ['es']
+        assert metadata['files']['es'] == {
+            'README': str(adventure.join('README.es.rst')),
+            'SOLUTION': None,
+        }
+
+        del sys.modules['manifest_story.first']
+        manager = Manager()
+        assert manager.get_adventure('first').title == 'First'
+        assert 'manifest_story.first' not in sys.modules
+        # The documents are found from the manifest.
+        manager.language = 'es'
+        with monkeypatch.context() as patch:
+            patch.setattr(BaseAdventure, 'find_file', None)
+            assert manager.get_adventure('first').problem == 'Primera'
+
+        adventure.join('README.rst').setmtime(0)
+        manager = Manager()
+        assert manager.manifest.get('first') is None
+
+        # Titles also depend on the translations and the story module.
+        catalogs = tmpdir.mkdir('locale').mkdir('es').mkdir('LC_MESSAGES')
+        catalogs.join('pyschool.po').write('')
+        monkeypatch.setattr('story.translation._localedirs', [str(tmpdir)])
+        manager.manifest.save(manager.manifest.build(manager))
+        assert Manager().manifest.get('first') is not None
+        catalogs.join('pyschool.po').setmtime(0)
+        assert Manager().manifest.get('first') is None
+
+        manager.manifest.save(manager.manifest.build(manager))
+        stat = os.stat(__file__)
+        os.utime(__file__, (stat.st_atime, stat.st_mtime + 1))
+        try:
+            assert Manager().manifest.get('first') is None
+        finally:
+            os.utime(__file__, (stat.st_atime, stat.st_mtime))
+
+
+def test_problem_document_language(tmpdir, monkeypatch):
+    package = tmpdir.mkdir('language_story')
+    package.join('__init__.py').write('')
+    adventure = package.mkdir('first')
+    adventure.join('__init__.py').write(
+        'from story.adventures import BaseAdventure\n'
+        'class Adventure(BaseAdventure):\n'
+        '    pass\n')
+    adventure.join('README.rst').write('First')
+    adventure.join('README.es.rst').write('Primera')
+    monkeypatch.syspath_prepend(str(tmpdir))
+
+    class Manager(AdventureManager):
+        name = title = 'example'
+        adventures = ['language_story.first']
+        completed_set = frozenset()
+
+    english, spanish = Manager(), Manager()
+    english.language, spanish.language = 'en', 'es'
+    activate('en')
+    assert 'Primera' in spanish.get_adventure('first').get_problem_document()
+    assert 'Para verificar tu programa' in spanish.get_adventure(
+        'first').get_problem_document()
+    assert 'To verify your program' in english.get_adventure(
+        'first').get_problem_document()
+    assert get_language() == 'en'
+
+
+def test_run_time_limit(tmpdir, capsys):
+    program = tmpdir.join('program.py')
+    program.write('import time\ntime.sleep(10)\n')
+    adventure = ExampleAdventure(None)
+    adventure.time_limit = 0.5
+    assert adventure.run(str(program), warm=False) == 1
+    assert capsys.readouterr().err == 'Your program took too long.\n'
@@ -1,7 +1,100 @@
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import types
+
 import pytest
 
 from story import __version__
-from story.commands import BaseCommand, CommandManager, VerifyCommand
+from story.adventures import AdventureVerificationError, BaseAdventure
+from story.commands import (BaseCommand, CommandError, CommandManager,
+                            CommandResult, CurrentCommand, HelpCommand,
+                            ListCommand, NextCommand, ResetCommand,
+                            SelectCommand, StatsCommand, VerifyBatchCommand,
+                            VerifyCommand)
+from story.stats import Stats
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ExampleManager(CommandManager):
+
+    description = 'Example'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def make_manager_class(count):
+    built = []
+
+    class ExampleCommand(BaseCommand):
+
+        def create_parser(self, parser):
+            built.append(self.name)
+            parser.add_argument('--value')
+
+        def handle(self, args):
+            self.manager.handled = (self.name, getattr(args, 'value', None))
+
+    commands = tuple(
+        type('Command{}'.format(index), (ExampleCommand,), {
+            'name': 'command{}'.format(index),
+            'help': 'Command number {}.'.format(index),
+        })
+        for index in range(count)
+    )
+    manager_class = type('Manager', (ExampleManager,), {
+        'commands': commands + (HelpCommand,),
+        'default_command': 'command0',
+    })
+    return manager_class, built
+
+
+def make_manager(count, argv):
+    manager_class, built = make_manager_class(count)
+    return manager_class(['story'] + argv), built
+
+
+def execute(manager):
+    with pytest.raises(SystemExit) as exit:
+        manager.execute()
+    return exit.value.code
+
+
+class FirstAdventure(BaseAdventure):
+    name = 'first'
+
+
+class SecondAdventure(BaseAdventure):
+    name = 'second'
+
+
+class ProgressManager(ExampleManager):
+
+    commands = (ListCommand, SelectCommand, CurrentCommand, NextCommand,
+                ResetCommand)
+    current = None
+    completed_set = frozenset(['first'])
+    data = {'completed': ['first']}
+
+    def __init__(self, argv=None):
+        super().__init__(argv)
+        self.adventures = [FirstAdventure(self), SecondAdventure(self)]
+        for position, adventure in enumerate(self.adventures, 1):
+            adventure.position = position
+
+    def get_adventure(self, name):
+        for adventure in self.adventures:
+            if adventure.name == name:
+                return adventure
 
 
 class TestCommandManager(object):
@@ -9,6 +102,85 @@ class TestCommandManager(object):
     def test_version(self):
         assert CommandManager().get_version() == __version__
 
+    def test_get_called_commands(self):
+        manager, built = make_manager(3, [])
+        command = manager.commands_by_name['command1']
+        assert manager.get_called_commands([]) == []
+        assert manager.get_called_commands(['-l', 'es']) == []
+        assert manager.get_called_commands(['command1']) == [command]
+        assert manager.get_called_commands(
+            ['--language=es', 'command1', '-h']) == [command]
+        assert manager.get_called_commands(['-les', 'command1']) == [command]
+        assert manager.get_called_commands(['missing']) is None
+        assert manager.get_called_commands(['--help']) is None
+
+    def test_execute(self):
+        manager, built = make_manager(10, ['command3', '--value', '1'])
+        assert execute(manager) == 0
+        assert manager.handled == ('command3', '1')
+        assert built == ['command3']
+
+        manager, built = make_manager(10, [])
+        assert execute(manager) == 0
+        assert manager.handled == ('command0', None)
+        assert built == []
+
+    def test_help(self, capsys):
+        manager, built = make_manager(3, ['help'])
+        execute(manager)
+        assert 'command2' in capsys.readouterr()[0]
+        assert len(built) == 3
+
+    def test_call(self):
+        manager = ProgressManager()
+        assert manager.call('list').data == [
+            {'name': 'first', 'position': 1, 'completed': True},
+            {'name': 'second', 'position': 2, 'completed': False},
+        ]
+        with pytest.raises(CommandError) as error:
+            manager.call('current')
+        assert str(error.value) == 'Please select an adventure first.'
+        manager.call('select', 'second')
+        result = manager.call('current')
+        assert result.data['name'] == 'second'
+        assert result.code == 0
+
+    def test_format(self, capsys):
+        assert execute(ProgressManager(['story', 'list'])) == 0
+        assert capsys.readouterr()[0] == '[*] first\n[ ] second\n'
+
+        manager = ProgressManager(['story', '--format', 'json', 'list'])
+        assert execute(manager) == 0
+        assert json.loads(capsys.readouterr()[0])[1]['name'] == 'second'
+
+        manager = ProgressManager(['story', '--format=json', 'current'])
+        assert execute(manager) == 1
+        assert json.loads(capsys.readouterr()[0]) == {
+            'error': 'Please select an adventure first.'}
+
+        # Every command writes JSON.
+        manager = ProgressManager(['story', '--format=json', 'next'])
+        assert execute(manager) == 1
+        assert json.loads(capsys.readouterr()[0]) == {
+            'error': 'Not implemented.'}
+        manager = ProgressManager(['story', '--format=json', 'reset'])
+        assert execute(manager) == 0
+        assert json.loads(capsys.readouterr()[0]) == {}
+
+
+def test_startup_time_by_number_of_commands():
+    # Calling a command builds its parser only, whatever the number of
+    # commands of the story.
+    for count in (10, 100, 1000):
+        manager_class, built = make_manager_class(count)
+        manager = manager_class(['story', 'command1', '--value', 'x'])
+        try:
+            manager.execute()
+        except SystemExit:
+            pass
+        assert manager.handled == ('command1', 'x')
+        assert built == ['command1']
+
 
 class TestBaseCommand(object):
 
@@ -23,7 +195,164 @@ class TestVerifyCommand(object):
         command = VerifyCommand(CommandManager())
 
         class Parser():
-            def add_argument(self, argument):
-                assert argument == 'file'
+            arguments = []
+
+            def add_argument(self, *arguments, **kwargs):
+                self.arguments.append(arguments[-1])
+
+        parser = Parser()
+        command.create_parser(parser)
+        assert parser.arguments == ['file', '--no-cache', '--watch']
+
+    def test_watch(self, monkeypatch):
+        def watch(path, callback):
+            callback()
+            raise KeyboardInterrupt
+
+        class Adventure(object):
+            name = 'example'
+            verified = []
+
+            def verify(self, file, use_cache):
+                self.verified.append(file)
+
+            def check(self, file, use_cache):
+                raise AssertionError('Verified again after watching')
+
+        monkeypatch.setattr('story.watch.watch', watch)
+        command = VerifyCommand(ExampleManager())
+        monkeypatch.setattr(command, 'get_current_adventure', Adventure)
+        monkeypatch.setattr(command.manager, 'flush', lambda: None,
+                            raising=False)
+        result = command.handle(argparse.Namespace(
+            file='program.py', use_cache=True, watch=True))
+        assert result.code == 0
+        assert result.data == {
+            'name': 'example', 'file': 'program.py', 'watched': True}
+        assert Adventure.verified == ['program.py']
+
+
+STORY = {
+    '__init__.py': '',
+    'story.py': (
+        'from story.story import BaseStory\n'
+        'class Story(BaseStory):\n'
+        '    name = "budget"\n'
+        '    adventures = [".first"]\n'),
+    'first/__init__.py': (
+        'from story.adventures import BaseAdventure\n'
+        'class Adventure(BaseAdventure):\n'
+        '    pass\n'),
+    'first/README.rst': 'First\n=====\n',
+    'first/SOLUTION.rst': 'print("First")\n',
+}
+
+RUN_STORY = ('import sys; from budget_story.story import Story; '
+             'Story(["story"] + sys.argv[1:]).execute()')
+
+# Modules only some commands need: running programs, SQLite, compiling
+# catalogs and inspecting source files.
+HEAVY_MODULES = ('multiprocessing', 'subprocess', 'runpy', 'sqlite3', 'ast',
+                 'inspect', 'pygments', 'curses')
+
+# The heavy modules every command may load.
+ALLOWED_MODULES = {
+    'list': (),
+    'select': (),
+    'current': (),
+    'print': ('pygments',),
+    'solution': ('pygments',),
+    'verify': ('multiprocessing', 'subprocess', 'runpy'),
+}
+
+
+def get_imported_modules(argv, env):
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', RUN_STORY] + argv,
+        stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, env=env,
+        universal_newlines=True).stderr
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        self_time, cumulative, module = line[12:].split('|')
+        if cumulative.strip().isdigit():
+            modules.append(module.strip())
+    return modules
+
+
+def test_import_time(tmpdir):
+    for name, content in STORY.items():
+        tmpdir.join('budget_story', name).write(content, ensure=True)
+    tmpdir.join('program.py').write('print("First")\n')
+    env = dict(
+        os.environ, HOME=str(tmpdir),
+        PYTHONPATH=os.pathsep.join([str(tmpdir), ROOT]))
+    commands = {command: [command] for command in ALLOWED_MODULES}
+    commands['select'].append('first')
+    commands['verify'].append(str(tmpdir.join('program.py')))
+    # Verify last, it unselects the adventure.
+    order = sorted(ALLOWED_MODULES, key=lambda command: command == 'verify')
+    # Run every command once first: the catalogs they use are compiled the
+    # first time only.
+    for command in order:
+        subprocess.run(
+            [sys.executable, '-c', RUN_STORY] + commands[command], env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    subprocess.check_call(
+        [sys.executable, '-c', RUN_STORY, 'select', 'first'], env=env)
+    for command in order:
+        allowed = ALLOWED_MODULES[command]
+        heavy = [
+            module for module in get_imported_modules(commands[command], env)
+            if module.startswith(HEAVY_MODULES) and
+            not module.startswith(allowed)
+        ]
+        assert not heavy, command
+
+
+class TestVerifyBatchCommand(object):
+
+    def test_handle(self, tmpdir, capsys):
+        class Adventure(BaseAdventure):
+            name = 'first'
+
+            def test(self, file):
+                with open(file) as f:
+                    if f.read() != 'print("ok")':
+                        raise AdventureVerificationError('Wrong')
+
+        adventure = Adventure(None)
+        manager = types.SimpleNamespace(
+            get_adventure={'first': adventure}.get)
+        tmpdir.join('first', 'good.py').write('print("ok")', ensure=True)
+        tmpdir.join('first', 'bad.py').write('print("ko")', ensure=True)
+        tmpdir.join('missing', 'other.py').write('', ensure=True)
+
+        parser = argparse.ArgumentParser()
+        command = VerifyBatchCommand(manager)
+        command.create_parser(parser)
+        command.handle(parser.parse_args([str(tmpdir), '-j', '2']))
+
+        out, err = capsys.readouterr()
+        results = {
+            os.path.basename(line['file']): line
+            for line in map(json.loads, out.splitlines())
+        }
+        assert results['good.py']['status'] == 'passed'
+        assert results['bad.py']['status'] == 'failed'
+        assert results['bad.py']['message'] == 'Wrong'
+        assert results['other.py']['status'] == 'error'
+        assert err.startswith('3 submissions verified')
+
+
+class TestStatsCommand(object):
 
-        command.create_parser(Parser())
+    def test_write_result(self):
+        stats = Stats(['first', 'second'])
+        stats.add({'language': 'es', 'completed': ['first']})
+        output = io.StringIO()
+        StatsCommand(None).write_result(
+            CommandResult(stats.as_dict()), output)
+        assert output.getvalue().startswith('Learners: 1\n')
+        assert '  es: 1 learners, 1 completions\n' in output.getvalue()
@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STORY = '''
+import sys
+
+from story.commands import BaseCommand
+from story.story import BaseStory
+
+
+class HelloCommand(BaseCommand):
+
+    name = 'hello'
+
+    def handle(self, args):
+        sys.stdout.write('{message} ' + sys.stdin.read() + '\\n')
+        sys.exit(3)
+
+
+class Story(BaseStory):
+
+    name = 'daemon'
+    filename = {progress!r}
+    commands = BaseStory.commands + (HelloCommand,)
+'''
+
+CLIENT = ('import sys; from story.daemon import client; '
+          'client("daemonstory.story:Story", address=sys.argv.pop(1))')
+
+
+@pytest.fixture
+def story(tmpdir):
+    package = tmpdir.mkdir('daemonstory')
+    package.join('__init__.py').write('')
+
+    def write(message):
+        package.join('story.py').write(STORY.format(
+            message=message, progress=str(tmpdir.join('progress'))))
+
+    write('Hello')
+    return tmpdir, write
+
+
+def call(tmpdir, address, *args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmpdir), ROOT]))
+    return subprocess.run(
+        [sys.executable, '-c', CLIENT, address] + list(args),
+        input='world', stdout=subprocess.PIPE, env=env,
+        universal_newlines=True, timeout=30)
+
+
+def test_server(story):
+    tmpdir, write = story
+    address = str(tmpdir.join('story.sock'))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmpdir), ROOT]))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'story.daemon', 'daemonstory.story:Story',
+         '--socket', address], env=env)
+    try:
+        for attempt in range(100):
+            if os.path.exists(address):
+                break
+            time.sleep(0.05)
+        result = call(tmpdir, address, 'hello')
+        assert result.returncode == 3
+        assert result.stdout == 'Hello world\n'
+
+        # Changes to the story are picked up.
+        write('Goodbye')
+        result = call(tmpdir, address, 'hello')
+        assert result.stdout == 'Goodbye world\n'
+    finally:
+        server.terminate()
+        server.wait(10)
+    assert not os.path.exists(address)
+
+
+def test_client_without_server(story):
+    tmpdir, write = story
+    result = call(tmpdir, str(tmpdir.join('missing.sock')), 'hello')
+    assert result.returncode == 3
+    assert result.stdout == 'Hello world\n'
@@ -0,0 +1,225 @@
+import json
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from story.adventures import AdventureVerificationError, BaseAdventure
+from story.backends import JSONBackend, SQLiteBackend
+from story.data import DataManager
+
+
+class CountingJSONBackend(JSONBackend):
+
+    written = 0
+
+    def save(self):
+        super().save()
+        with open(self.filename, 'rb') as f:
+            self.written += len(f.read())
+
+
+class ExampleData(DataManager):
+
+    name = 'example'
+    backend_class = CountingJSONBackend
+
+    def __init__(self, filename, legacy_filename=None):
+        # Skip translation loading, only the storage is tested here.
+        self.filename = filename
+        self.legacy_filename = legacy_filename
+
+
+class TestDataManager(object):
+
+    def test_nothing_written_without_changes(self, tmpdir):
+        filename = str(tmpdir.join('.pyschool'))
+        with ExampleData(filename) as manager:
+            manager.current
+            manager.completed
+        assert manager.backend.written == 0
+        assert not tmpdir.join('.pyschool').exists()
+
+    def test_verify_writes_once(self, tmpdir):
+        filename = str(tmpdir.join('.pyschool'))
+        with ExampleData(filename) as manager:
+            manager.completed = 'first'
+            manager.current = None
+            assert manager.backend.written == 0
+        with open(filename) as f:
+            size = len(f.read())
+        # A verify (completed + current) costs a single document write.
+        assert manager.backend.written == size
+        with open(filename) as f:
+            assert json.load(f) == {
+                'example': {'completed': ['first'], 'current': None}}
+
+    def test_unchanged_value_skips_write(self, tmpdir):
+        filename = str(tmpdir.join('.pyschool'))
+        with ExampleData(filename) as manager:
+            manager.completed = 'first'
+        with ExampleData(filename) as manager:
+            manager.completed = 'first'
+        assert manager.backend.written == 0
+
+    def test_completed_set(self, tmpdir):
+        names = ['adventure-{}'.format(i) for i in range(5000)]
+        filename = str(tmpdir.join('.pyschool'))
+        with ExampleData(filename) as manager:
+            manager.completed = names[::2]
+            manager.completed = names[1]
+
+        manager = ExampleData(filename)
+        reads = []
+        get_value = manager.get_value
+        manager.get_value = lambda *args: reads.append(args) or get_value(
+            *args)
+        completed = [name for name in names if name in manager.completed_set]
+        # Rendering a list of thousands of adventures reads progress once.
+        assert len(reads) == 1
+        assert completed == [names[0], names[1]] + names[2::2]
+        assert manager.completed == names[::2] + [names[1]]
+
+    def test_result_cache(self, tmpdir, results_dir, capsys):
+        runs = []
+
+        class Adventure(BaseAdventure):
+            sandboxed = False
+
+            def test(self, file):
+                runs.append(file)
+                with open(file) as f:
+                    if f.read() != 'ok':
+                        raise AdventureVerificationError('Wrong')
+
+        class Manager(ExampleData):
+            results_size = 2
+
+            def get_version(self):
+                return '1.0'
+
+        manager = Manager(str(tmpdir.join('.pyschool')))
+        adventure = Adventure(manager)
+        files = []
+        for content in ('ko', 'ok', 'ko2'):
+            files.append(str(tmpdir.join(content)))
+            tmpdir.join(content).write(content)
+
+        assert adventure.verify(files[0]) == 1
+        assert adventure.verify(files[0]) == 1
+        assert adventure.verify(files[0], use_cache=False) == 1
+        assert len(runs) == 2
+        assert adventure.verify(files[1]) == 0
+        assert adventure.verify(files[1]) == 0
+        assert len(runs) == 3
+
+        # The least recently used result is dropped: the hit on files[0]
+        # keeps it, files[1] is verified again.
+        adventure.verify(files[0])
+        adventure.verify(files[2])
+        assert len(results_dir.join('example').listdir()) == 2
+        assert len(runs) == 4
+        adventure.verify(files[0])
+        assert len(runs) == 4
+        adventure.verify(files[1])
+        assert len(runs) == 5
+
+        # The recency order is kept across processes, and hits don't write
+        # the progress.
+        manager.flush()
+        manager = Manager(str(tmpdir.join('.pyschool')))
+        adventure = Adventure(manager)
+        adventure.verify(files[1])
+        adventure.verify(files[0])
+        manager.flush()
+        assert manager.backend.written == 0
+        assert 'results' not in json.loads(tmpdir.join('.pyschool').read())[
+            'example']
+        assert len(runs) == 5
+
+        # A new submission content is verified again.
+        tmpdir.join('ok').write('changed')
+        assert adventure.verify(files[1]) == 1
+        assert len(runs) == 6
+
+
+class TestSQLiteBackend(object):
+
+    def test_point_reads_and_writes(self, tmpdir):
+        filename = str(tmpdir.join('pyschool.db'))
+        backend = SQLiteBackend(filename)
+        backend.set('example', 'completed', ['first'])
+        backend.set('other', 'current', 'second')
+        backend.flush()
+
+        backend = SQLiteBackend(filename)
+        assert backend.get('example', 'completed') == ['first']
+        assert backend.get('example', 'current') is None
+        assert backend.get_story('other') == {'current': 'second'}
+
+    def test_lock_held_only_while_saving(self, tmpdir):
+        filename = str(tmpdir.join('pyschool.db'))
+        first = SQLiteBackend(filename)
+        first.set('example', 'completed', ['first'])
+        first.flush()
+        # Unchanged values leave nothing to save.
+        first.set('example', 'completed', ['first'])
+        assert not first._changes
+
+        first.set('example', 'language', 'es')
+        second = SQLiteBackend(filename)
+        second._connection = sqlite3.connect(filename, timeout=0.1)
+        second.set('example', 'completed', ['second'])
+        second.flush()
+
+        first.flush()
+        assert SQLiteBackend(filename).get_story('example') == {
+            'completed': ['first', 'second'], 'language': 'es'}
+
+    def test_migration(self, tmpdir):
+        legacy_filename = str(tmpdir.join('.pyschool'))
+        with open(legacy_filename, 'w') as f:
+            json.dump({'example': {'completed': ['first']}}, f)
+
+        manager = ExampleData(str(tmpdir.join('pyschool.db')),
+                              legacy_filename)
+        manager.backend_class = SQLiteBackend
+        assert manager.completed == ['first']
+        manager.completed = 'second'
+        manager.flush()
+        assert SQLiteBackend(manager.filename).get_story('example') == {
+            'completed': ['first', 'second']}
+
+
+def verify_adventures(backend_class, filename, names):
+    for name in names:
+        # Every adventure is verified by a separate command.
+        manager = ExampleData(filename)
+        manager.backend_class = backend_class
+        with manager:
+            manager.completed = name
+            manager.current = None
+
+
+@pytest.mark.parametrize('backend_class, basename', [
+    (JSONBackend, '.pyschool'),
+    (SQLiteBackend, 'pyschool.db'),
+])
+def test_concurrent_verify(tmpdir, backend_class, basename):
+    filename = str(tmpdir.join(basename))
+    processes = [
+        multiprocessing.Process(
+            target=verify_adventures,
+            args=(backend_class, filename,
+                  ['adventure-{}-{}'.format(i, j) for j in range(10)]))
+        for i in range(8)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    completed = backend_class(filename).get('example', 'completed')
+    assert sorted(completed) == sorted(
+        'adventure-{}-{}'.format(i, j) for i in range(8) for j in range(10))
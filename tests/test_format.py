@@ -0,0 +1,112 @@
+import io
+import tracemalloc
+
+from story import format
+
+
+class TestHighlight(object):
+
+    def test_memory_cache(self, monkeypatch):
+        calls = []
+        highlight = format.pygments.highlight
+        monkeypatch.setattr(format, '_cache', format.OrderedDict())
+        monkeypatch.setattr(
+            format.pygments, 'highlight',
+            lambda *args: calls.append(args) or highlight(*args))
+        assert format.highlight('Title\n=====\n') == format.highlight(
+            'Title\n=====\n')
+        assert len(calls) == 1
+        assert calls[0][1] is format.get_lexer()
+
+    def test_disk_cache(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('STORY_CACHE_DIR', str(tmpdir))
+        monkeypatch.setattr(format, '_cache', format.OrderedDict())
+        result = format.highlight('Title\n=====\n')
+        key = format.get_cache_key('Title\n=====\n')
+        assert tmpdir.join(key).read() == result
+
+        monkeypatch.setattr(format, '_cache', format.OrderedDict())
+        monkeypatch.setattr(format.pygments, 'highlight', None)
+        assert format.highlight('Title\n=====\n') == result
+
+    def test_disk_cache_write_error(self, tmpdir, monkeypatch):
+        def replace(source, target):
+            raise OSError('No space left on device')
+
+        monkeypatch.setenv('STORY_CACHE_DIR', str(tmpdir))
+        monkeypatch.setattr(format.os, 'replace', replace)
+        format.write_cache('key', 'result')
+        assert tmpdir.listdir() == []
+
+    def test_stream(self, monkeypatch):
+        monkeypatch.setattr(format, '_cache', format.OrderedDict())
+        monkeypatch.setattr(format, 'CACHE_MAX_LENGTH', 1024)
+        content = ''.join(
+            'Section {0}\n==========\n\n.. code:: python\n\n'
+            '    print({0})\n\n'.format(i) for i in range(500))
+        assert len(content) > format.CACHE_MAX_LENGTH
+
+        lexed = []
+        lexer = format.get_lexer()
+
+        class Lexer(object):
+            def get_tokens(self, content):
+                for token in lexer.get_tokens(content):
+                    lexed.append(token)
+                    yield token
+
+        class Output(object):
+            writes = 0
+            first = None
+
+            def write(self, chunk):
+                if self.first is None:
+                    self.first = len(lexed)
+                self.writes += 1
+
+        output = Output()
+        with monkeypatch.context() as patch:
+            patch.setattr(format, 'get_lexer', Lexer)
+            format.highlight_to(content, output)
+        tracemalloc.start()
+        format.highlight_to(content, Output())
+        streamed = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        rendered = format.highlight(content)
+        buffered = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # Output starts long before the whole document has been lexed, and
+        # no copy of the result is held in memory.
+        assert output.writes > 500
+        assert output.first < len(lexed) / 10
+        assert streamed < buffered - len(rendered)
+
+    def test_formatter_per_file(self, monkeypatch):
+        class Terminal(object):
+            def isatty(self):
+                return True
+
+        monkeypatch.setattr(format, '_cache', format.OrderedDict())
+        monkeypatch.setattr(format.sys, 'stdout', Terminal())
+        output = io.StringIO()
+        format.highlight_to('Title\n=====\n', output)
+        # Written to a file, not the terminal, so without escape codes.
+        assert output.getvalue() == 'Title\n=====\n'
+        assert list(format._cache) == [format.get_cache_key(
+            'Title\n=====\n', format.NullFormatter)]
+
+    def test_formatter_per_call(self, monkeypatch):
+        class Terminal(object):
+            def isatty(self):
+                return True
+
+        monkeypatch.setenv('TERM', 'xterm-256color')
+        monkeypatch.setattr(format.sys, 'stdout', io.StringIO())
+        assert isinstance(format.get_formatter(), format.NullFormatter)
+        monkeypatch.setattr(format.sys, 'stdout', Terminal())
+        assert isinstance(
+            format.get_formatter(), format.Terminal256Formatter)
+        monkeypatch.setenv('TERM', 'xterm')
+        assert isinstance(format.get_formatter(), format.TerminalFormatter)
+        assert format.get_formatter() is format.get_formatter()
@@ -0,0 +1,111 @@
+import fcntl
+import os
+import select
+import struct
+import types
+
+import pytest
+
+from story import menu
+from story.menu import Keys, Menu, SpaceItem
+
+pty = pytest.importorskip('pty')
+termios = pytest.importorskip('termios')
+
+
+def make_story():
+    adventures = [
+        types.SimpleNamespace(
+            name='adventure{}'.format(index),
+            title='Adventure {}'.format(index),
+            completed=index % 2 == 0)
+        for index in range(15)
+    ]
+    return types.SimpleNamespace(
+        title='Example', adventures=adventures, language='en',
+        set_current=lambda name: None)
+
+
+class Window(object):
+
+    def __init__(self):
+        self.rows = []
+
+    def addstr(self, y, x, text, style):
+        self.rows.append(y)
+
+    def noutrefresh(self):
+        pass
+
+
+def test_render_dirty_items(monkeypatch):
+    monkeypatch.setattr(menu.curses, 'doupdate', lambda: None)
+    monkeypatch.setattr(menu.curses, 'color_pair', lambda number: number)
+    story = make_story()
+    level = Menu(story).get_initial()
+    level.window = Window()
+    level.panel = object()
+
+    level.render()
+    assert len(level.window.rows) == len(
+        [item for item in level if not isinstance(item, SpaceItem)])
+
+    # Moving the selection draws the previous and the new selected rows.
+    level.window.rows = []
+    level.next()
+    level.render()
+    assert level.window.rows == [5, 6]
+
+    level.window.rows = []
+    level.render()
+    assert level.window.rows == []
+
+    level.invalidate()
+    level.render()
+    assert len(level.window.rows) > 2
+
+
+def read_output(fd, idle=0.2):
+    """Return the number of bytes written until the output is idle."""
+    total = 0
+    while select.select([fd], [], [], idle)[0]:
+        try:
+            data = os.read(fd, 65536)
+        except OSError:
+            break
+        if not data:
+            break
+        total += len(data)
+    return total
+
+
+def test_bytes_per_keypress():
+    # Benchmark: the menu runs in a pseudo-terminal, and every keypress is
+    # measured by the bytes it makes curses write.
+    pid, fd = pty.fork()
+    if pid == 0:
+        try:
+            os.environ['TERM'] = 'xterm-256color'
+            Menu(make_story()).show()
+        finally:
+            os._exit(0)
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', 40, 100, 0, 0))
+    try:
+        initial = read_output(fd, idle=1)
+        written = {}
+        for key in (Keys.J, Keys.J, Keys.J, Keys.K, Keys.K, 0):
+            os.write(fd, bytes([key]))
+            written.setdefault(key, []).append(read_output(fd))
+    finally:
+        os.write(fd, bytes([Keys.Q]))
+        read_output(fd)
+        os.waitpid(pid, 0)
+        os.close(fd)
+    assert initial > 0
+    # Only the two rows whose selection changed are sent, with their
+    # attributes: a row is well under 80 bytes.
+    for size in written[Keys.J] + written[Keys.K]:
+        assert 0 < size < 2 * 80
+    assert max(written[Keys.J] + written[Keys.K]) < initial / 4
+    # Keys without action write nothing.
+    assert written[0] == [0]
@@ -0,0 +1,137 @@
+import io
+import time
+
+import pytest
+
+from story.adventures import AdventureVerificationError, BaseAdventure
+from story.runner import (VerificationResult, run_program, run_test,
+                          run_tests)
+
+
+class ExampleAdventure(BaseAdventure):
+
+    time_limit = 2
+    cpu_time_limit = 1
+    memory_limit = 256 * 1024 * 1024
+
+    def test(self, file):
+        if file == 'fail':
+            raise AdventureVerificationError('Wrong answer')
+        elif file == 'crash':
+            raise ValueError('Broken test')
+        elif file == 'sleep':
+            time.sleep(10)
+        elif file == 'loop':
+            while True:
+                pass
+        elif file == 'memory':
+            b' ' * (1024 * 1024 * 1024)
+
+
+def run(file):
+    return run_test(ExampleAdventure(None), file)
+
+
+class TestRunner(object):
+
+    def test_passed(self):
+        result = run('pass')
+        assert result.passed
+        assert result.as_dict()['status'] == VerificationResult.PASSED
+
+    def test_failed(self):
+        result = run('fail')
+        assert result.status == VerificationResult.FAILED
+        assert result.message == 'Wrong answer'
+
+    def test_error(self):
+        result = run('crash')
+        assert result.status == VerificationResult.ERROR
+        assert 'Broken test' in result.message
+
+    def test_wall_clock_timeout(self):
+        result = run('sleep')
+        assert result.status == VerificationResult.TIMEOUT
+        assert result.duration < 5
+
+    def test_cpu_timeout(self):
+        result = run('loop')
+        assert result.status == VerificationResult.TIMEOUT
+
+    def test_memory_limit(self):
+        result = run('memory')
+        assert result.status == VerificationResult.ERROR
+
+    def test_parallel(self):
+        adventure = ExampleAdventure(None)
+        start = time.monotonic()
+        results = dict(run_tests(
+            [(adventure, 'sleep'), (adventure, 'pass'), (adventure, 'fail')],
+            workers=3))
+        assert time.monotonic() - start < 5
+        assert results[(adventure, 'pass')].passed
+        assert not results[(adventure, 'fail')].passed
+        assert not results[(adventure, 'sleep')].passed
+
+
+class TestRunProgram(object):
+
+    @pytest.mark.parametrize('warm', [True, False])
+    def test_input_and_output(self, tmpdir, warm):
+        program = tmpdir.join('program.py')
+        program.write(
+            'import sys\n'
+            'name = input()\n'
+            'print("Hello, " + name)\n'
+            'sys.exit(3)\n')
+        output = io.StringIO()
+        result = run_program(str(program), 'Ada\n', output, warm=warm)
+        assert output.getvalue() == 'Hello, Ada\n'
+        assert result.returncode == 3
+        assert not result.timed_out
+
+    @pytest.mark.parametrize('warm', [True, False])
+    def test_timeout(self, tmpdir, warm):
+        program = tmpdir.join('program.py')
+        program.write('print("start", flush=True)\nwhile True:\n    pass\n')
+        output = io.StringIO()
+        result = run_program(
+            str(program), '', output, time_limit=0.5, warm=warm)
+        assert result.timed_out
+        assert output.getvalue() == 'start\n'
+
+    def test_error(self, tmpdir):
+        program = tmpdir.join('program.py')
+        program.write('raise ValueError("boom")\n')
+        output = io.StringIO()
+        result = run_program(str(program), '', output)
+        assert result.returncode == 1
+        assert 'ValueError: boom' in output.getvalue()
+
+    @pytest.mark.parametrize('warm', [True, False])
+    def test_timeout_after_closing_output(self, tmpdir, warm):
+        program = tmpdir.join('program.py')
+        program.write(
+            'import os, time\n'
+            'os.close(1)\n'
+            'os.close(2)\n'
+            'time.sleep(10)\n')
+        start = time.monotonic()
+        result = run_program(
+            str(program), '', io.StringIO(), time_limit=0.5, warm=warm)
+        assert time.monotonic() - start < 5
+        assert result.timed_out
+
+    @pytest.mark.parametrize('warm', [True, False])
+    def test_imports_next_to_program(self, tmpdir, warm):
+        # A module named like one of the library's must not be shadowed.
+        tmpdir.join('utils.py').write('NAME = "learner"\n')
+        program = tmpdir.join('program.py')
+        program.write(
+            'import sys, utils\n'
+            'print(utils.NAME)\n'
+            'print("story" in sys.modules)\n')
+        output = io.StringIO()
+        result = run_program(str(program), '', output, warm=warm)
+        assert output.getvalue() == 'learner\nFalse\n'
+        assert result.returncode == 0
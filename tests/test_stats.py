@@ -0,0 +1,86 @@
+import json
+import os
+
+from story.backends import SQLiteBackend
+from story.stats import Stats, collect, read_progress
+
+ADVENTURES = ['first', 'second', 'third']
+
+
+def write_progress(path, completed, language='en', story='example'):
+    path.write(json.dumps({
+        story: {'completed': completed, 'language': language},
+        'other': {'completed': ['first']},
+    }), ensure=True)
+
+
+def test_read_progress(tmpdir):
+    path = tmpdir.join('learner')
+    write_progress(path, ['second'], 'es')
+    assert read_progress(str(path), 'example') == {
+        'language': 'es', 'completed': ['second']}
+    assert read_progress(str(path), 'missing') is None
+
+    tmpdir.join('broken').write('{')
+    assert read_progress(str(tmpdir.join('broken')), 'example') is None
+    for content in ([], {'example': ['first']}, {'example': 'first'},
+                    {'example': {'completed': 'first'}},
+                    {'example': {'completed': {'first': True}}},
+                    {'example': {'language': ['es']}}):
+        tmpdir.join('invalid').write(json.dumps(content))
+        assert read_progress(str(tmpdir.join('invalid')), 'example') is None
+    tmpdir.join('invalid').write(json.dumps(
+        {'example': {'completed': ['first', ['second']]}}))
+    assert read_progress(str(tmpdir.join('invalid')), 'example') == {
+        'language': 'en', 'completed': ['first']}
+
+    backend = SQLiteBackend(str(tmpdir.join('learner.db')))
+    backend.set('example', 'completed', ['first'])
+    backend.flush()
+    backend.close()
+    assert read_progress(str(tmpdir.join('learner.db')), 'example') == {
+        'language': 'en', 'completed': ['first']}
+
+
+def test_stats():
+    stats = Stats(ADVENTURES)
+    for completed, language in [
+            ([], 'en'),
+            (['first'], 'en'),
+            (['second', 'first'], 'es'),
+            (['first', 'second', 'third'], 'en'),
+            (['third'], 'es')]:
+        stats.add({'completed': completed, 'language': language})
+    data = stats.as_dict()
+    assert data['learners'] == 5
+    assert [adventure['completed'] for adventure in data['adventures']] == [
+        3, 2, 2]
+    assert data['languages']['es'] == {
+        'learners': 2, 'completed': {'first': 1, 'second': 1, 'third': 1}}
+    assert data['funnel'] == [
+        {'name': 'first', 'reached': 3, 'dropped': 2},
+        {'name': 'second', 'reached': 2, 'dropped': 1},
+        {'name': 'third', 'reached': 1, 'dropped': 1},
+    ]
+
+
+def test_collect(tmpdir):
+    learners = tmpdir.mkdir('learners')
+    for index in range(20):
+        write_progress(
+            learners.join('group{}'.format(index % 3), str(index)),
+            ADVENTURES[:index % 4])
+    learners.join('group0', '0.lock').write('')
+    cache = str(tmpdir.join('cache.json'))
+
+    stats = collect(str(learners), 'example', ADVENTURES, cache, jobs=4)
+    assert stats.learners == 20
+    assert stats.read == 20
+    assert stats.completed['first'] == 15
+
+    # Only changed files are read again.
+    write_progress(learners.join('group1', '1'), [])
+    os.utime(str(learners.join('group1', '1')), ns=(0, 0))
+    stats = collect(str(learners), 'example', ADVENTURES, cache)
+    assert (stats.read, stats.cached) == (1, 19)
+    assert stats.completed['first'] == 14
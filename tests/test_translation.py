@@ -3,7 +3,14 @@ Simple Test for translations
 
 Author: Ignacio Avas <iavas@sophilabs.com>
 """
-from story.translation import gettext, activate
+import asyncio
+import gettext as gettext_module
+import os
+import time
+
+from story.catalog import MappedCatalog, compile_catalog, write_mo
+from story import translation
+from story.translation import gettext, activate, override
 
 
 class TestStory(object):
@@ -17,3 +24,157 @@ class TestStory(object):
         activate('es')
         translation = gettext("Choose language")
         assert translation == "Elige un idioma"
+
+
+def test_compiled_catalog(tmpdir):
+    localedirs = []
+    for name in ('core', 'story'):
+        localedir = tmpdir.mkdir(name)
+        messages = {'': 'Content-Type: text/plain; charset=utf-8\n'}
+        messages.update(
+            ('{} {}'.format(name, i), '{} {} translated'.format(name, i))
+            for i in range(5000))
+        messages['Exit'] = '{} exit'.format(name)
+        directory = localedir.join('locale', 'es', 'LC_MESSAGES')
+        directory.ensure(dir=True)
+        write_mo(
+            {key.encode(): value.encode() for key, value in messages.items()},
+            str(directory.join('pyschool.mo')))
+        localedirs.append(str(localedir))
+
+    start = time.perf_counter()
+    merged = None
+    for localedir in localedirs:
+        path = os.path.join(
+            localedir, 'locale', 'es', 'LC_MESSAGES', 'pyschool.mo')
+        with open(path, 'rb') as f:
+            other = gettext_module.GNUTranslations(f)
+        if merged is None:
+            merged = other
+        else:
+            merged._catalog.update(other._catalog)
+    merge_time = time.perf_counter() - start
+
+    directory = str(tmpdir.join('compiled'))
+    compile_catalog('pyschool', 'es', localedirs, directory)
+    start = time.perf_counter()
+    catalog = MappedCatalog(
+        compile_catalog('pyschool', 'es', localedirs, directory))
+    compiled_time = time.perf_counter() - start
+
+    assert len(os.listdir(directory)) == 1
+    assert catalog.get('Exit') == 'story exit'
+    for key, value in merged._catalog.items():
+        assert catalog[key] == value
+    assert catalog.get('Missing') is None
+    # Mapping the compiled catalog doesn't parse anything.
+    assert compiled_time < merge_time
+
+
+def test_compile_po(tmpdir):
+    directory = tmpdir.join('locale', 'es', 'LC_MESSAGES')
+    directory.ensure(dir=True)
+    source = directory.join('pyschool.po')
+    source.write(
+        '#, fuzzy\n'
+        'msgid ""\n'
+        'msgstr "Content-Type: text/plain; charset=utf-8\\n"\n'
+        '\n'
+        '#, fuzzy, python-format\n'
+        'msgid "Exit"\n'
+        'msgstr "Salir"\n'
+        '\n'
+        '#: menu.py:1\n'
+        'msgctxt "menu"\n'
+        'msgid "Back"\n'
+        'msgstr "Volver"\n')
+    compiled = tmpdir.join('compiled')
+    filename = compile_catalog('pyschool', 'es', [str(tmpdir)], str(compiled))
+    catalog = MappedCatalog(filename)
+    assert 'charset=utf-8' in catalog['']
+    assert catalog.get('Exit') is None
+    assert catalog['menu\x04Back'] == 'Volver'
+    assert os.stat(filename).st_mode & 0o777 == 0o644
+
+    # Compiling edited sources removes the previous file, and the files
+    # named the way they were before of the same language.
+    compiled.join('pyschool-es-{}.mo'.format('0' * 40)).write('')
+    compiled.join('pyschool-en-{}.mo'.format('0' * 40)).write('')
+    source.write(source.read().replace('Volver', 'Atras'))
+    os.utime(str(source), ns=(0, os.stat(filename).st_mtime_ns + 1))
+    filename = compile_catalog('pyschool', 'es', [str(tmpdir)], str(compiled))
+    assert sorted(compiled.listdir()) == [
+        compiled.join('pyschool-en-{}.mo'.format('0' * 40)),
+        compiled.join(os.path.basename(filename))]
+    assert MappedCatalog(filename)['menu\x04Back'] == 'Atras'
+
+
+def test_compiled_catalog_fallback(tmpdir, monkeypatch):
+    def fail(filename):
+        raise OSError('mmap failed')
+
+    directory = tmpdir.join('locale', 'es', 'LC_MESSAGES')
+    directory.ensure(dir=True)
+    write_mo({b'Exit': b'Salir'}, str(directory.join('pyschool.mo')))
+    monkeypatch.setattr(translation, '_localedirs', [str(tmpdir)])
+    monkeypatch.setenv('STORY_CATALOG_DIR', str(tmpdir.join('c')))
+    monkeypatch.setattr(translation, 'MappedCatalog', fail)
+    spanish = translation.Translations('es').update()
+    assert not spanish.compiled
+    assert spanish.gettext('Exit') == 'Salir'
+
+
+def test_add_localedir_merges_lazily(tmpdir, monkeypatch):
+    monkeypatch.setattr(translation, '_localedirs',
+                        list(translation._localedirs))
+    monkeypatch.setattr(translation, '_localedir_set',
+                        set(translation._localedir_set))
+    monkeypatch.setattr(translation, '_translations', {})
+    monkeypatch.setenv('STORY_CATALOG_DIR', str(tmpdir.join('c')))
+    directory = tmpdir.join('locale', 'es', 'LC_MESSAGES')
+    directory.ensure(dir=True)
+    directory.join('pyschool.po').write(
+        'msgid "Choose language"\n'
+        'msgstr "Elige tu idioma"\n')
+    calls = []
+
+    def record(domain, language, localedirs):
+        calls.append(localedirs)
+        return compile_catalog(domain, language, localedirs)
+
+    monkeypatch.setattr(translation, 'compile_catalog', record)
+
+    activate('es')
+    spanish = translation.get_translation()
+    assert gettext('Choose language') == 'Elige un idioma'
+    for i in range(100):
+        translation.add_localedir(str(tmpdir))
+    assert translation._localedirs.count(str(tmpdir)) == 1
+    # Nothing is merged until the translation is used again.
+    assert str(tmpdir) not in spanish.localedirs
+    assert gettext('Choose language') == 'Elige tu idioma'
+    assert str(tmpdir) in spanish.localedirs
+    # Only the added directory is compiled, and mapped over the others.
+    assert calls == [translation._localedirs[:-1], [str(tmpdir)]]
+    assert gettext("It didn't work. Try again.") == (
+        'No funcionó. Prueba nuevamente')
+
+
+def test_override_per_task():
+    async def translate(language, results):
+        with override(language):
+            for i in range(3):
+                results.append(str(gettext('Choose language')))
+                await asyncio.sleep(0)
+
+    async def main():
+        english, spanish = [], []
+        await asyncio.gather(
+            translate('en', english), translate('es', spanish))
+        return english, spanish
+
+    activate('en')
+    english, spanish = asyncio.run(main())
+    assert english == ['Choose language'] * 3
+    assert spanish == ['Elige un idioma'] * 3
+    assert translation.get_language() == 'en'
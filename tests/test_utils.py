@@ -0,0 +1,89 @@
+import importlib
+import sys
+
+from story.utils import _proxy_class, lazy
+
+
+class Counter(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.key = 'en'
+
+    def translate(self, message):
+        self.calls += 1
+        return '{}:{}'.format(self.key, message)
+
+
+class TestLazy(object):
+
+    def test_not_memoized(self):
+        counter = Counter()
+        proxy = lazy(counter.translate, str)('Exit')
+        for i in range(100):
+            assert str(proxy) == 'en:Exit'
+            assert proxy.upper() == 'EN:EXIT'
+        assert counter.calls == 200
+
+    def test_memoized(self):
+        counter = Counter()
+        proxy = lazy(counter.translate, str, key=lambda: counter.key)('Exit')
+        for i in range(100):
+            assert str(proxy) == 'en:Exit'
+            assert proxy.upper() == 'EN:EXIT'
+            assert hash(proxy) == hash('en:Exit')
+        assert counter.calls == 1
+
+        counter.key = 'es'
+        assert str(proxy) == 'es:Exit'
+        assert proxy == 'es:Exit'
+        assert counter.calls == 2
+
+    def test_proxy_class_prepared_once(self, monkeypatch):
+        counter = Counter()
+        proxy = lazy(counter.translate, str)('Exit')
+        proxy_class = type(proxy)
+
+        def prepare():
+            raise AssertionError('Proxy class prepared again')
+
+        monkeypatch.setattr(proxy_class, '__prepare_class__', prepare)
+        other = lazy(counter.translate, str)('Help')
+        assert type(other) is proxy_class
+        assert str(other) == 'en:Help'
+        assert not hasattr(other, '__dict__')
+
+
+# Translated strings at the top level of a module, like the commands and the
+# menu have.
+MESSAGES_MODULE = '\n'.join(
+    ['from story.translation import gettext as _'] +
+    ["MESSAGE_{0} = _('Message number {0}')".format(index)
+     for index in range(500)])
+
+
+def test_import_time(tmpdir, monkeypatch):
+    # Importing a module with 500 translated strings builds no proxy class,
+    # the one of gettext is shared by all of them.
+    tmpdir.join('lazy_messages.py').write(MESSAGES_MODULE)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    import story.translation  # noqa: F401
+    misses = _proxy_class.cache_info().misses
+    try:
+        messages = importlib.import_module('lazy_messages')
+    finally:
+        sys.modules.pop('lazy_messages', None)
+    assert _proxy_class.cache_info().misses == misses
+    assert len({
+        type(getattr(messages, 'MESSAGE_{}'.format(index)))
+        for index in range(500)
+    }) == 1
+
+    # Calling lazy() for every string prepares the class once too.
+    counter = Counter()
+    before = _proxy_class.cache_info()
+    for index in range(500):
+        lazy(counter.translate, str)
+    after = _proxy_class.cache_info()
+    assert after.misses - before.misses == 1
+    assert after.hits - before.hits == 499
@@ -0,0 +1,45 @@
+import threading
+import time
+
+import pytest
+
+from story.watch import InotifyWatcher, PollingWatcher, get_watcher, watch
+
+
+class Stop(Exception):
+    pass
+
+
+@pytest.mark.parametrize('watcher_class', [InotifyWatcher, PollingWatcher])
+def test_watch(tmpdir, watcher_class):
+    program = tmpdir.join('program.py')
+    program.write('1')
+    watcher = watcher_class(str(program))
+    watcher.interval = 0.05
+    calls = []
+
+    def callback():
+        calls.append(program.read())
+        if len(calls) == 2:
+            raise Stop()
+
+    def edit():
+        time.sleep(0.2)
+        # Several quick writes, like an editor saving, verify once.
+        for content in ('2', '23', '234'):
+            program.write(content)
+            program.setmtime(time.time() + len(content))
+            time.sleep(0.02)
+
+    thread = threading.Thread(target=edit)
+    thread.start()
+    with pytest.raises(Stop):
+        watch(str(program), callback, debounce=0.15, watcher=watcher)
+    thread.join()
+    assert calls == ['1', '234']
+
+
+def test_get_watcher(tmpdir):
+    watcher = get_watcher(str(tmpdir.join('program.py')))
+    assert not watcher.wait(0.01)
+    watcher.close()